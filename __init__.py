@@ -1 +1 @@
-__all__ = [ "hc", "console", "constants", "debug", "display", "mpformat", "numeric", "si", "stack"]
+__all__ = [ "hc", "bench", "bigint", "console", "constants", "debug", "display", "memory", "mpformat", "numeric", "packed", "si", "spill", "stack", "stats"]
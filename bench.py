@@ -0,0 +1,284 @@
+'''
+Timing helpers for the calculator's bench command.
+
+---------------------------------------------------------------------------
+Copyright (c) 2011, Vernon Mauery
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or
+without modification, are permitted provided that the following
+conditions are met:
+
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following
+disclaimer in the documentation and/or other materials provided
+with the distribution.
+* The names of the contributors may not be used to endorse or
+promote products derived from this software without specific
+prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import gc
+import sys
+import time
+from si import suffixes_nl
+
+# time.clock has the best resolution on Windows, time.time elsewhere.
+if sys.platform == "win32":
+    timer = time.clock
+else:
+    timer = time.time
+
+def median(values):
+    '''Return the median of a sequence of numbers.'''
+    s = sorted(values)
+    n = len(s)
+    if n == 0:
+        raise ValueError("median of an empty sequence")
+    if n % 2:
+        return s[n//2]
+    return (s[n//2 - 1] + s[n//2])/2.0
+
+def format_time(seconds):
+    '''Format a time in seconds using an SI prefix, e.g. "12.3 us".'''
+    if seconds <= 0:
+        return "0 s"
+    exponent = 0
+    while seconds*10**-exponent < 1 and exponent > -9:
+        exponent -= 3
+    return "%.3g %ss" % (seconds*10**-exponent, suffixes_nl[exponent])
+
+class BenchResult(object):
+    '''The per-iteration times (in seconds) and net object counts of a
+    timed run.
+    '''
+    def __init__(self):
+        self.times = []
+        self.objects = []
+
+    def __len__(self):
+        return len(self.times)
+
+    def min(self):
+        return min(self.times)
+
+    def median(self):
+        return median(self.times)
+
+    def max(self):
+        return max(self.times)
+
+    def objects_per_iteration(self):
+        return median(self.objects)
+
+    def __str__(self):
+        return "%d iterations:  min %s  median %s  max %s  " \
+            "retained objects %.4g" % \
+            (len(self), format_time(self.min()), format_time(self.median()),
+             format_time(self.max()), self.objects_per_iteration())
+
+def Bench(func, n, setup=None, inner=1):
+    '''Call func() n times and return a BenchResult.  If setup is given,
+    it is called before each iteration and is not timed.  Operations too
+    fast for the timer's resolution can be run inner times per sample;
+    the results are then reported per call.
+
+    The garbage collector is disabled while func runs, so the change in
+    gc.get_count()[0] is the net number of container objects (Zn,
+    Rational, tuples, dicts, ...) func left allocated.  It is not an
+    allocation count:  temporaries freed before func returns cancel out,
+    so it shows what a formulation keeps (on the stack, say), not how much
+    garbage it makes.  Python 2 has no hook for counting allocations.
+    '''
+    result = BenchResult()
+    loop = range(inner)
+    gc_was_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        for i in xrange(n):
+            if setup is not None:
+                setup()
+            if gc.get_count()[0] > 10000:
+                gc.collect()    # Keep cyclic garbage from piling up
+            objects = gc.get_count()[0]
+            start = timer()
+            for j in loop:
+                func()
+            elapsed = timer() - start
+            result.objects.append((gc.get_count()[0] - objects)/float(inner))
+            result.times.append(elapsed/inner)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return result
+
+if __name__ == "__main__":
+    # Time the calculator's primitives.  Usage:  python bench.py [n]
+    import random
+    from mpmath import mp, mpf, sqrt
+    from fractions import Fraction
+    from numeric import Zn, Rational, Number, Fixed, qformat, sort_key
+    from stats import quantile, bin_edges, histogram
+    from stack import Stack
+    n = 100
+    if len(sys.argv) > 1:
+        n = int(sys.argv[1])
+    def report(name, func, setup=None, inner=1000):
+        print "%-24s %s" % (name, Bench(func, n, setup, inner))
+    a, b, c = Zn(12345), Zn(678), Zn(3)
+    report("Zn add", lambda: a + b)
+    report("Zn mul", lambda: a * b)
+    report("Zn and", lambda: a & b)
+    report("Zn shift", lambda: a << c)
+    report("Zn(n)", lambda: Zn(12345))
+    s32 = Zn()
+    s32.bits = 32
+    a32, b32 = Zn(12345, s32), Zn(678, s32)
+    report("s32 add", lambda: a32 + b32)
+    report("s32 mul", lambda: a32 * b32)
+    q15 = qformat(0, 15)
+    f1, f2 = Fixed(Rational(1, 3), q15), Fixed(Rational(-2, 7), q15)
+    report("q0.15 add", lambda: f1 + f2)
+    report("q0.15 mul", lambda: f1 * f2)
+    # Integer-only scripts, each a long run of operations on Zn
+    one, two, three = Zn(1), Zn(2), Zn(3)
+    def fib():
+        x, y = Zn(0), one
+        for i in xrange(1000):
+            x, y = y, x + y
+    def collatz():
+        for i in xrange(1, 100):
+            x = Zn(i)
+            while x != one:
+                if x & one == one:
+                    x = three*x + one
+                else:
+                    x = x >> one
+    def factorial():
+        x = one
+        for i in xrange(1, 300):
+            x = x*Zn(i)
+    # Net objects each small value leaves on a list (like the stack)
+    parse, kept = Number(), []
+    report("keep parsed 7", lambda: kept.append(parse("7")))
+    report("keep 3 + 3", lambda: kept.append(c + c))
+    del kept[:]
+    report("fib 1000 script", fib, inner=1)
+    report("collatz 1..99 script", collatz, inner=1)
+    report("300! script", factorial, inner=1)
+    # Where gmpy2 starts to pay off:  python and gmpy2 (with the
+    # conversions to and from mpz) on operands of a growing size.
+    import bigint
+    report("factorial 5000", lambda: bigint.factorial(5000), inner=1)
+    report("comb 10**4 5000", lambda: bigint.comb(10**4, 5000), inner=1)
+    report("gcd 2048 bits", lambda: bigint.gcd(3**1290, 7**730), inner=10)
+    if bigint.gmpy2 is None:
+        print "gmpy2 is not installed; no crossovers to measure"
+    else:
+        # The shapes bigint's thresholds are for:  mul of two operands
+        # of bits bits, div with a divisor and quotient of bits bits and
+        # power with a result of bits bits.
+        mpz = bigint.gmpy2.mpz
+        for name, py, gm, shape in (
+            ("mul", lambda a, b: a*b, lambda a, b: int(mpz(a)*b),
+             lambda bits: (bits, bits)),
+            ("div", lambda a, b: a//b, lambda a, b: int(mpz(a)//b),
+             lambda bits: (2*bits, bits)),
+            ("power", lambda a, b: a**b, lambda a, b: int(mpz(a)**b),
+             lambda bits: (max(bits//4, 2), 4))):
+            crossover = None
+            for bits in [int(32*2**(i/2.0)) for i in xrange(16)]:
+                xbits, y = shape(bits)
+                x = random.getrandbits(xbits) | 1 << xbits - 1
+                if name != "power":
+                    y = random.getrandbits(y) | 1 << y - 1
+                t_py = Bench(lambda: py(x, y), n, inner=10).median()
+                t_gm = Bench(lambda: gm(x, y), n, inner=10).median()
+                print "%s %6d bits  python %-10s gmpy2 %s" % \
+                    (name, bits, format_time(t_py), format_time(t_gm))
+                if crossover is None and t_gm < t_py:
+                    crossover = bits
+            print "%s crossover:  %s bits" % (name, crossover)
+    p, q = Rational(1, 3), Rational(2, 7)
+    report("Rational add", lambda: p + q)
+    # Continued fraction style chains of rational arithmetic
+    def convergent():
+        # The 200th convergent of e's continued fraction [2; 1, 2, 1, 1, 4, ...]
+        terms = [2] + [(i//3 + 1)*2 if i % 3 == 1 else 1 for i in xrange(199)]
+        x = Rational(terms[-1])
+        for a in reversed(terms[:-1]):
+            x = a + Rational(1)/x
+        return str(x)
+    def sqrt2():
+        # Newton's iteration for sqrt(2), all in rationals
+        x = Rational(1)
+        for i in xrange(8):
+            x = (x + Rational(2)/x)*Rational(1, 2)
+        return str(x)
+    def harmonic():
+        x = Rational(1)
+        for i in xrange(2, 200):
+            x = x + Rational(1, i)
+        return str(x)
+    report("e convergent 200", convergent, inner=1)
+    report("sqrt(2) newton 8", sqrt2, inner=1)
+    report("harmonic 200", harmonic, inner=1)
+    mp.dps = 1000
+    root2 = sqrt(mpf(2))
+    mp.dps = 15
+    report("frac 1000 digits", lambda: Rational().frac(root2, 1000), inner=10)
+    x, y = sqrt(mpf(2)), sqrt(mpf(3))
+    report("mpf add", lambda: x + y)
+    big = Stack()
+    big.extend(xrange(10**6))
+    report("roll 10**6 stack", lambda: big.roll(0))
+    report("rolld 10**6 stack", lambda: big.roll(-1))
+    report("swap 10**6 stack", big.swap)
+    report("pick 10 10**6 stack", lambda: big[10])
+    report("window 10 10**6 stack", lambda: big.window(10), inner=100)
+    spilled = Stack()
+    spilled.set_spill(1000, "~/.pycalc")
+    spilled.extend(xrange(10**5))
+    report("pick 10 spilled stack", lambda: spilled[10])
+    report("pick 10**4 spilled stack", lambda: spilled[10**4], inner=100)
+    report("roll spilled stack", lambda: spilled.roll(0), inner=100)
+    packed = Stack()
+    packed.set_spill(1000)
+    packed.extend([Zn(i) for i in xrange(10**5)])
+    report("pick 10**4 packed stack", lambda: packed[10**4])
+    report("roll packed stack", lambda: packed.roll(0))
+    # Sorting is too slow to repeat n times
+    random.seed(0)
+    mixed = []
+    for i in xrange(10**6):
+        r = random.randrange(3)
+        if r == 0:
+            mixed.append(Zn(random.randrange(-1000, 1000)))
+        elif r == 1:
+            mixed.append(Rational(random.randrange(-10**6, 10**6),
+                                  random.randrange(1, 1000)))
+        else:
+            mixed.append(mpf(random.uniform(-1000, 1000)))
+    print "%-24s %s" % ("sort 10**6 mixed",
+        Bench(lambda: sorted(mixed, key=sort_key), 3))
+    print "%-24s %s" % ("median 10**6 mixed",
+        Bench(lambda: quantile(mixed, Fraction(1, 2)), 3))
+    def hist():
+        keys = map(sort_key, mixed)
+        return histogram(keys, bin_edges(keys, 20))
+    print "%-24s %s" % ("hist 20 10**6 mixed", Bench(hist, 3))
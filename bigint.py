@@ -0,0 +1,192 @@
+'''
+Exact integer functions that use gmpy2 when it is installed and fall
+back to pure python when it is not.  The results are always python ints
+or longs, so the rest of the calculator doesn't see the difference.
+
+---------------------------------------------------------------------------
+Copyright (c) 2011, Vernon Mauery
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or
+without modification, are permitted provided that the following
+conditions are met:
+
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following
+disclaimer in the documentation and/or other materials provided
+with the distribution.
+* The names of the contributors may not be used to endorse or
+promote products derived from this software without specific
+prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+try:
+    import gmpy2
+except ImportError:
+    gmpy2 = None
+
+# gmpy2 is faster than python's own arithmetic only once the cost of
+# converting to and from mpz is paid back.  Python's multiplication and
+# division of longs take time proportional to the product of the sizes
+# of the operands (of the divisor and quotient for a division), so the
+# thresholds are on that product.  From "python bench.py" with gmpy2
+# 2.0.8 (GMP 6.2.1) on python 2.7 (x86-64):
+#   mul    gmpy2 wins from 448 by 448 bits (python 185 ns, gmpy2 175)
+#          and 2048 by 128 (265 ns, 200); python wins at 384 by 384
+#          (150 ns, 165) and 2048 by 64 (180 ns, 190)
+#   div    the two are even at a 256 bit divisor and quotient (166 ns,
+#          180 in one run; 250 ns, 190 in another); gmpy2 wins at 320 by
+#          320 (225 ns, 196) and python at 224 by 224 (145 ns, 180)
+#   power  python's int**int is only quick while the result fits in a
+#          machine word:  3**20 takes 55 ns in python and 120 in gmpy2,
+#          3**40 takes 550 ns and 130
+# gcd, factorial, comb and isqrt are python loops without gmpy2, so
+# gmpy2 wins for them even on small numbers (gcd(12, 18) 300 ns and 170,
+# 5! 249 ns and 135).
+mul_bits = 448
+div_bits = 256
+pow_bits = 64
+
+# Without gmpy2, gcd switches from Euclid's algorithm to Lehmer's when
+# both numbers are at least this big; below it the extra python-level
+# work costs more than the big divisions it saves.
+lehmer_bits = 8192
+
+def gcd(a, b):
+    '''The greatest common divisor of the ints a and b, with the sign
+    of b (or of a if b is 0), so dividing a fraction's numerator and
+    denominator by it makes the denominator positive.  Euclid's
+    algorithm from Knuth, vol 2, pg 320, if gmpy2 is not installed.
+    '''
+    if gmpy2 is None and (a.bit_length() < lehmer_bits or
+                          b.bit_length() < lehmer_bits):
+        if a == 0:  return b
+        if b == 0:  return a
+        while b != 0:
+            a, b = b, a % b
+        return a
+    if gmpy2 is not None:
+        g = int(gmpy2.gcd(a, b))
+    else:
+        g = _lehmer(abs(a), abs(b))
+    if b < 0 or (b == 0 and a < 0):
+        return -g
+    return g
+
+def _lehmer(u, v):
+    # Lehmer's gcd, Knuth vol 2, algorithm 4.5.2L.  Each pass runs
+    # Euclid's algorithm on the leading 120 bits of u and v for as long
+    # as the quotients are certain to be the same as for u and v
+    # themselves, then applies all of those steps to u and v at once.
+    # This replaces most of the divisions of big numbers with a few
+    # multiplications by small ones.
+    if u < v:
+        u, v = v, u
+    while v.bit_length() > 120:
+        shift = u.bit_length() - 120
+        x, y = u >> shift, v >> shift
+        A, B, C, D = 1, 0, 0, 1
+        while y + C and y + D:
+            q = (x + A)//(y + C)
+            if q != (x + B)//(y + D):
+                break
+            A, C = C, A - q*C
+            B, D = D, B - q*D
+            x, y = y, x - q*y
+        if B == 0:
+            u, v = v, u % v
+        else:
+            u, v = A*u + B*v, C*u + D*v
+    while v:
+        u, v = v, u % v
+    return u
+
+# The operators for ints.  Without gmpy2 they are the ones in the
+# operator module, so they cost no more than a function call.
+if gmpy2 is not None:
+    def mul(a, b):
+        if a.bit_length()*b.bit_length() >= mul_bits*mul_bits:
+            return int(gmpy2.mpz(a)*b)
+        return a*b
+
+    def _big_division(a, b):
+        d = b.bit_length()
+        return d*(a.bit_length() - d) >= div_bits*div_bits
+
+    def floordiv(a, b):
+        if _big_division(a, b):
+            return int(gmpy2.mpz(a)//b)
+        return a//b
+
+    def mod(a, b):
+        if _big_division(a, b):
+            return int(gmpy2.mpz(a) % b)
+        return a % b
+
+    def power(a, b):
+        '''a**b for b >= 0.'''
+        if a.bit_length()*b > pow_bits:
+            return int(gmpy2.mpz(a)**b)
+        return a**b
+else:
+    from operator import mul, floordiv, mod, pow as power
+
+def _product(lo, hi):
+    # The product of lo through hi - 1, split in halves so the big
+    # multiplications are between numbers of about the same size.
+    if hi - lo <= 8:
+        p = 1
+        for i in xrange(lo, hi):
+            p *= i
+        return p
+    mid = (lo + hi)//2
+    return _product(lo, mid)*_product(mid, hi)
+
+def factorial(n):
+    '''n! for an int n >= 0.'''
+    if n < 0:
+        raise ValueError("factorial of a negative number")
+    if gmpy2 is not None:
+        return int(gmpy2.fac(n))
+    return _product(2, n + 1)
+
+def comb(n, k):
+    '''The number of ways of choosing k of n things, for ints n, k >= 0.'''
+    if n < 0 or k < 0:
+        raise ValueError("comb needs nonnegative numbers")
+    if k > n:
+        return 0
+    if gmpy2 is not None:
+        return int(gmpy2.comb(n, k))
+    k = min(k, n - k)
+    return _product(n - k + 1, n + 1)//_product(2, k + 1)
+
+def isqrt(n):
+    '''The largest int whose square is <= n, for an int n >= 0.'''
+    if n < 0:
+        raise ValueError("isqrt of a negative number")
+    if gmpy2 is not None:
+        return int(gmpy2.isqrt(n))
+    if n == 0:
+        return 0
+    # Newton's method from above; it decreases until it reaches the root
+    x = 1 << (n.bit_length() + 1)//2
+    while True:
+        y = (x + n//x)//2
+        if y >= x:
+            return x
+        x = y
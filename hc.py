@@ -36,10 +36,11 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #----------------------------------
 # Python library stuff
 from __future__ import division
-import sys, getopt, os, time, readline
+import sys, getopt, os, time, readline, shlex, heapq, csv, json, struct
 from socket import htonl
 from atexit import register as atexit
 from string import strip
+from itertools import imap, chain
 import traceback
 import re as regex
 from tempfile import mkstemp
@@ -68,7 +69,13 @@ apt-get install python-mpmath python-simpleparse
 # Modules needed in our package
 from numeric import *
 from stack import Stack
+from packed import PackedStore
 from mpformat import mpFormat
+from bench import Bench, format_time
+from stats import Moments, Sums, quantile, bin_edges, histogram, \
+    exact, real, to_mpf
+from fractions import Fraction
+from memory import sizeof, describe, AllocationTracer
 import constants
 import console
 
@@ -88,6 +95,35 @@ status_unknown_command  = 3
 status_ok_no_display    = 4
 status_interrupted      = 5
 JULIAN_UNIX_EPOCH = Julian("1Jan1970:00:00:00")
+valid_stack_name = regex.compile(r"^\w+$")
+json_number = regex.compile(r"^-?(0|[1-9]\d*)(\.\d+)?([eE][+-]?\d+)?$")
+
+def json_value(s):
+    '''The JSON form of the number s:  a bare number if a double holds its
+    value exactly, otherwise a string, so that JSON readers don't round it.
+    '''
+    if json_number.match(s):
+        try:
+            if Fraction(s) == Fraction(float(s)):
+                return s
+        except (OverflowError, ValueError):
+            pass    # Too big for a double
+    return json.dumps(s)
+
+def jsonl_rows(f):
+    '''The "value" of each line of the JSON lines file f as a one field row,
+    with bare numbers kept as the text they were written with.  A line
+    without a "value" is returned as it is.
+    '''
+    for line in f:
+        try:
+            x = json.loads(line, parse_int=str, parse_float=str)["value"]
+        except (ValueError, KeyError, TypeError):
+            yield [line]
+            continue
+        if isinstance(x, unicode):
+            x = x.encode("utf-8")
+        yield [str(x)]
 
 
 class ParseError(Exception):
@@ -104,6 +140,9 @@ class Calculator(object):
     def __init__(self, arguments, options):
         self.errors = []
         self.stack = Stack()
+        # Named stacks; self.stack is the one in use
+        self.stacks = {"main" : self.stack}
+        self.stack_name = "main"
         self.stack_index = True
         self.constants = constants.ParseRawData()
         self.display = Display()     # Used to display messages to user
@@ -111,6 +150,18 @@ class Calculator(object):
         self.ap = mpFormat()         # For formatting arguments of complex numbers
         self.number = Number()
         self.registers = {}          # Keeps all stored registers
+        self.register_bank = []      # The indexed registers for sto[i], rcl[i]
+        self.sums = Sums()           # The summation registers for s+ and s-
+        # DisplayStack keeps the strings of the entries it showed last
+        # time:  id(x) : (x, format_generation, item_is_x, string).
+        # format_generation is bumped by FormatChanged().
+        self.format_cache = {}
+        self.format_generation = 0
+        self.tracer = AllocationTracer()  # Per-command allocations for mem
+        # For each of the most recent input lines, a list of (stack, journal)
+        # for the stacks the line changed; used by undo and redo.
+        self.undo_history = []
+        self.redo_history = []
         self.commands_dict = {
             # Values are
             # [
@@ -157,6 +208,7 @@ class Calculator(object):
             "iv"       : [self.ToIV, 2],   # Convert to [y,x] interval number
             "gcf"      : [self.gcf, 2],  # find the greatest common factor
             "lcd"      : [self.lcd, 2],  # find the lowest common denominator
+            "limitden" : [self.limitden, 2],  # Closest fraction with denominator <= x
 
             # Unary functions
             "I"        : [self.Cast_i, 1],  # Convert to integer
@@ -166,6 +218,7 @@ class Calculator(object):
             "C"        : [self.Cast_c, 1],  # Convert to complex number
             "T"        : [self.Cast_t, 1],  # Convert to time/date
             "V"        : [self.Cast_v, 1],  # Convert to interval number
+            "fixed"    : [self.Cast_x, 1],  # Convert to fixed point number
             "cast"     : [self.cast, 1],  # Convert integer to current C int type
             "IP"       : [self.IP, 1],  # Convert to ip address
             "2deg"     : [self.ToDegrees, 1],  # Convert x to radians
@@ -183,6 +236,7 @@ class Calculator(object):
             "chop"     : [self.Chop, 1],  # Convert x to its displayed value
             "conj"     : [self.conj, 1],  # Complex conjugate of x
             "sqrt"     : [self.sqrt, 1],  # Square root of x
+            "isqrt"    : [self.isqrt, 1], # Integer square root of x
             "cbrt"     : [self.cbrt, 1],  # Cube root of x
             "root"     : [self.root, 2],  # nth root of x
             "roots"    : [self.roots, 2],  # nth roots of x
@@ -238,6 +292,14 @@ class Calculator(object):
             "clear"    : [self.Reset, 0], # Reset the calculator state
             "stack"    : [self.SetStackDisplay, 1],
             "lastx"    : [self.lastx, 0], # Recall last x used
+            "undo"     : [self.undo, 0], # Undo the last line's stack changes
+            "redo"     : [self.redo, 0], # Redo what undo reversed
+            "undos"    : [self.SetUndoLevels, 1],
+            "spill"    : [self.SetSpill, 1], # Keep deep stack entries on disk
+            "pack"     : [self.SetPack, 1], # Pack deep stack entries into arrays
+            "stack:new" : [self.NewStack, 'line'], # Create a named stack
+            "stack:use" : [self.UseStack, 'line'], # Switch to a named stack
+            "stack:move" : [self.MoveToStack, 'line'], # Move entries to another stack
             "swap"     : [self.swap, 0],   # swap x and y
             "roll"     : [self.roll, 0],  # Roll stack
             "rolld"    : [self.rolld, 0],  # Roll stack down
@@ -250,6 +312,32 @@ class Calculator(object):
             "dup2"     : [self.dup2, 2],   # Push a copy of x and y onto the stack
             "dupn"     : [self.dupn, 'x'],  # duplicate top x values on stack
             "depth"    : [self.depth, 0],  # Push stack depth onto stack
+            "sort"     : [self.sort, 1],  # Sort the top x values, largest on top
+            "rsort"    : [self.rsort, 1], # Sort the top x values, smallest on top
+            "uniq"     : [self.uniq, 1],  # Remove repeated values from the top x
+            "reverse"  : [self.reverse, 1], # Reverse the order of the top x values
+
+            # Statistics of the top x values, which are left on the stack
+            "mean"     : [self.mean, 1],
+            "var"      : [self.var, 1],   # Sample variance
+            "sdev"     : [self.sdev, 1],  # Sample standard deviation
+            "min"      : [self.min, 1],
+            "max"      : [self.max, 1],
+            "median"   : [self.median, 1],
+            "quantile" : [self.quantile, 2], # y x quantile:  x quantile of top y
+            "hist"     : [self.hist, 'line'], # Count the top values in bins
+
+            # Summation registers, which keep only running sums of points
+            "s+"       : [self.splus, 2],  # y x s+:  add the point (x, y)
+            "s-"       : [self.sminus, 2], # y x s-:  remove the point (x, y)
+            "sclr"     : [self.sclr, 0],  # Clear the summation registers
+            "sn"       : [self.sn, 0],    # Number of points
+            "smean"    : [self.smean, 0], # Means of y and x
+            "ssdev"    : [self.ssdev, 0], # Standard deviations of y and x
+            "slope"    : [self.slope, 0], # Slope of the regression line
+            "yint"     : [self.yint, 0],  # y intercept of the regression line
+            "corr"     : [self.corr, 0],  # Correlation coefficient
+            "fcst"     : [self.fcst, 1],  # y on the regression line at x
 
             # constants
             "phi"      : [self.Phi, 0],   # Golden ratio
@@ -280,6 +368,10 @@ class Calculator(object):
             "rad"      : [self.rad, 0],  # Set radians for angle mode
             "regs"     : [self.PrintRegisters, 0],
             "cfg"      : [self.ShowConfig, 0], # Show configuration
+            "bench"    : [self.bench, 'line'], # Time an expression
+            "mem"      : [self.mem, 'line'], # Show memory used by stack and registers
+            "load"     : [self.load, 'line'], # Push the numbers in a file
+            "save"     : [self.save, 'line'], # Write the stack to a file
             "modulo"   : [self.Modulus, 1], # All answers displayed with this modulus
             "clrg"     : [self.ClearRegisters, 0],
             ">>."      : [self.display.logoff, 0],  # Turn off logging
@@ -312,6 +404,7 @@ class Calculator(object):
             # integer modes
             "sx"       : [self.C_sX, 1],  # Unsigned n-bit integer mode
             "ux"       : [self.C_uX, 1],  # Signed n-bit integer mode
+            "fixmode"  : [self.fixmode, 'line'],  # Fixed point format, rounding and overflow
             "dec"      : [self.dec, 0],  # Decimal display for integers
             "hex"      : [self.hex, 0],  # Hex display for integers
             "oct"      : [self.oct, 0],  # Octal for integers
@@ -356,8 +449,13 @@ class Calculator(object):
         calculator_grammar := statement / ws
         statement := simple_statement / (simple_statement, ws, statement) / help_statement
         help_statement := 'help',(ws,(delimited_func / operator))?
-        simple_statement := cint / delimited_func / constant / ipaddr / number / operator / (number, ows, operator)
+        simple_statement := register / cint / fixed_number / qformat / delimited_func / constant / ipaddr / number / operator / (number, ows, operator)
         cint := [us],[0-9]+
+        # Up to the '>' or a space, so a malformed one such as 1<q0.15 is
+        # rejected rather than read as 1 < q0.15
+        fixed_number := real_number_ns,'<',-[ \t\n>]*,'>'?
+        qformat := 'u'?,'q',[0-9]+,'.',[0-9]+
+        register := ('sto' / 'rcl'),'[',[0-9]+,(':',[0-9]+)?,']'
         constant := 'const'
         operator := '+' / '*' / '/' / '-' / '%' / '^' / '&' / '!'
         ipaddr := ipv6cidr / ipv4cidr / ipv6 / ipv4
@@ -408,6 +506,9 @@ class Calculator(object):
             traceback.print_exception(type, value, tb, None, sys.stdout)
         self.chomppre = regex.compile(r"^\s*")
         self.chomppost = regex.compile(r"\s*$")
+        self.cints = regex.compile(r"[su][0-9]+")
+        self.qformats = regex.compile(r"u?q[0-9]+\.[0-9]+$")
+        self.register_ref = regex.compile(r"^(sto|rcl)\[(\d+)(?::(\d+))?\]$")
 
         #---------------------------------------------------------------------------
         #---------------------------------------------------------------------------
@@ -493,6 +594,18 @@ class Calculator(object):
             "tempfile" : "",
             # How many items of the stack to show.  Use 0 for all.
             "stack_display" : 0,
+            # How many lines of input undo can reverse.  Use 0 to turn off
+            # undo.
+            "undo_levels" : 20,
+            # If nonzero, only this many (up to twice as many) of the top
+            # entries of each stack are kept in memory; the rest are written
+            # to a temporary file in spill_dir.
+            "spill_depth" : 0,
+            "spill_dir" : "~/.pycalc",
+            # When not spilling, all but the top pack_depth (up to twice as
+            # many) entries of each stack are packed into arrays in memory.
+            # Use 0 to keep every entry as an object.
+            "pack_depth" : 10000,
 
             # If the following variable is True, we will persist our settings from
             # run to run.  Otherwise, our configuration comes from this dictionary
@@ -590,6 +703,13 @@ class Calculator(object):
             self.display.msg("Using default configuration only")
         if options.version:
             self.display.msg("hcpy version 6 (17 Mar 2009)")
+        if options.read_stdin:
+            self.process_stdin = True
+        if options.input_file:
+            try:
+                self.LoadFile(options.input_file)
+            except ValueError, e:
+                self.display.msg(str(e))
 
     #---------------------------------------------------------------------------
     # Utility functions
@@ -867,6 +987,9 @@ class Calculator(object):
             raise ValueError(self.argument_types % fln())
         y = Convert(y, INT)
         x = Convert(x, INT)
+        limit = self.cfg["factorial_limit"]
+        if 0 <= x <= y and (limit == 0 or y < limit):
+            return bigint.comb(int(y), int(x))
         return int(self.permutation(y, x)//self.Factorial(x))
 
     def permutation(self, y, x):
@@ -946,6 +1069,19 @@ class Calculator(object):
         if isinstance(x, Zn): x = int(x)
         return m.sqrt(x)
 
+    def isqrt(self, x):
+        """
+    Usage: x isqrt
+
+    Returns the largest integer whose square is less than or equal to x
+        """
+        if (not self.cfg["coerce"]) and (not isint(x)):
+            raise ValueError("%sx must be an integer >= 0" % fln())
+        x = int(Convert(x, INT))
+        if x < 0:
+            raise ValueError("%sx must be an integer >= 0" % fln())
+        return bigint.isqrt(x)
+
     def cbrt(self, x):
         """
     Usage: x cbrt
@@ -1004,9 +1140,7 @@ class Calculator(object):
                 return self.factorial_cache[x]
             else:
                 if x > 2:
-                    y = 1
-                    for i in xrange(2, x+1):
-                        y *= i
+                    y = bigint.factorial(int(x))
                     self.factorial_cache[x] = y
                     return y
         limit = self.cfg["factorial_limit"]
@@ -1633,9 +1767,185 @@ class Calculator(object):
 
     Push the saved last x back onto the stack
         """
-        assert self.stack.lastx != None, "Bug:  stack.lastx is None"
+        if self.stack.lastx is None:
+            raise ValueError("%sNo last x yet" % fln())
         return self.stack.lastx
 
+    def undo(self):
+        """
+    Usage: undo
+
+    Reverses the changes the last line of input made to the stack.  Repeat
+    it to go further back, up to the number of levels set with undos.
+        """
+        if not self.undo_history:
+            raise ValueError("%sNothing to undo" % fln())
+        level = self.undo_history.pop()
+        self.redo_history.append([(s, s.undo(j)) for s, j in level])
+
+    def redo(self):
+        """
+    Usage: redo
+
+    Puts back the stack changes reversed by undo.  Entering anything other
+    than undo or redo that changes the stack forgets what can be redone.
+        """
+        if not self.redo_history:
+            raise ValueError("%sNothing to redo" % fln())
+        level = self.redo_history.pop()
+        self.undo_history.append([(s, s.undo(j)) for s, j in level])
+
+    def SetUndoLevels(self, x):
+        """
+    Usage: n undos
+
+    Keep the stack changes of the last n lines of input for undo.  Only the
+    entries each line pushed, popped or replaced are kept, not copies of
+    the stack.  Use 0 to turn off undo.
+        """
+        if int(x) != x or x < 0:
+            self.display.msg("Undo levels must be an integer >= 0")
+            return x
+        self.cfg["undo_levels"] = int(x)
+        self.TrimUndo()
+
+    def SetSpill(self, x):
+        """
+    Usage: n spill
+
+    Keep only the top n to 2n entries of each stack in memory and move the
+    rest to a temporary file in the spill_dir directory (~/.pycalc by
+    default).  Spilled entries are read back as the stack shrinks or when
+    they are picked or rolled.  Use 0 to keep everything in memory.
+        """
+        if int(x) != x or x < 0:
+            self.display.msg("Spill depth must be an integer >= 0")
+            return x
+        self.cfg["spill_depth"] = int(x)
+        self.SpillChanged()
+
+    def SetPack(self, x):
+        """
+    Usage: n pack
+
+    Keep only the top n to 2n entries of each stack as objects and pack
+    the rest into arrays:  Zn values of one width (e.g. in s32 mode) take
+    8 bytes each and reals of up to 64 bits of precision 17 bytes.  Packed
+    entries are turned back into objects when they are used.  Use 0 to
+    keep every entry as an object.  Spilling to disk (see spill) takes
+    the place of packing.
+        """
+        if int(x) != x or x < 0:
+            self.display.msg("Pack depth must be an integer >= 0")
+            return x
+        self.cfg["pack_depth"] = int(x)
+        self.SpillChanged()
+
+    def SpillChanged(self):
+        for stack in self.stacks.itervalues():
+            self.SetStorage(stack)
+
+    def SetStorage(self, stack):
+        if self.cfg["spill_depth"]:
+            stack.set_spill(self.cfg["spill_depth"], self.cfg["spill_dir"])
+        else:
+            stack.set_spill(self.cfg["pack_depth"])
+
+    def TrimUndo(self):
+        levels = self.cfg["undo_levels"]
+        del self.undo_history[:len(self.undo_history) - levels]
+        if not levels:
+            self.redo_history = []
+
+    def StartUndo(self):
+        '''Start journaling the changes to every stack.'''
+        for stack in self.stacks.itervalues():
+            stack.journal = []
+
+    def SaveUndo(self):
+        '''Stop journaling and keep the changes the line of input made for
+        undo.  Lines that did not change any stack (such as undo and redo
+        themselves) leave the undo and redo histories alone.
+        '''
+        level = []
+        for stack in self.stacks.itervalues():
+            if stack.journal:
+                level.append((stack, stack.journal))
+            stack.journal = None
+        if level:
+            self.undo_history.append(level)
+            self.redo_history = []
+            self.TrimUndo()
+
+    def GetStack(self, name):
+        if name not in self.stacks:
+            raise ValueError("%sNo stack named '%s'" % (fln(), name))
+        return self.stacks[name]
+
+    def NewStack(self, line=''):
+        """
+    Usage: stack:new name
+
+    Creates an empty stack called name and switches to it.  The stack you
+    start with is called main.  See stack:use and stack:move.
+        """
+        args = line.split()
+        if len(args) != 1 or not valid_stack_name.match(args[0]):
+            raise ValueError("%sUsage: stack:new name" % fln())
+        name = args[0]
+        if name in self.stacks:
+            raise ValueError("%sStack '%s' already exists" % (fln(), name))
+        stack = Stack()
+        self.SetStorage(stack)
+        if self.stack.journal is not None:
+            stack.journal = []
+        self.stacks[name] = stack
+        self.UseStack(name)
+
+    def UseStack(self, line=''):
+        """
+    Usage: stack:use [name]
+
+    Switches to the stack called name.  Without a name, lists the stacks
+    and their sizes; the one in use is marked with a '*'.
+        """
+        args = line.split()
+        if not args:
+            names = self.stacks.keys()
+            names.sort()
+            for name in names:
+                mark = " "
+                if name == self.stack_name:
+                    mark = "*"
+                self.display.msg("%s %-16s %d entries" % (mark, name,
+                    len(self.stacks[name])))
+            return
+        if len(args) != 1:
+            raise ValueError("%sUsage: stack:use [name]" % fln())
+        self.stack = self.GetStack(args[0])
+        self.stack_name = args[0]
+
+    def MoveToStack(self, line=''):
+        """
+    Usage: stack:move n name
+
+    Moves the top n entries of the stack to the top of the stack called
+    name, keeping their order.  The entries themselves are not copied.
+        """
+        usage = "%sUsage: stack:move n name"
+        args = line.split()
+        if len(args) != 2 or not integer.match(args[0]):
+            raise ValueError(usage % fln())
+        n, other = int(args[0]), self.GetStack(args[1])
+        if n < 0:
+            raise ValueError(usage % fln())
+        if other is self.stack:
+            return
+        if n > len(self.stack):
+            raise IndexError("'stack:move' requires %d args (stack size is %d)" %
+                (n, len(self.stack)))
+        other.extend(self.stack.popn(n))
+
 
     def swap(self):
         """
@@ -1737,6 +2047,347 @@ class Calculator(object):
         """
         return len(self.stack)
 
+    def Reorder(self, n, func):
+        '''Replace the top n items on the stack (all of them if n is 0)
+        with func(items), where items is a list with the top item last.
+        '''
+        if not isint(n) or n < 0:
+            raise ValueError("%sn must be an integer >= 0" % fln())
+        n = int(n)
+        if n > len(self.stack):
+            raise ValueError("%sStack size is only %d" % (fln(), len(self.stack)))
+        items = self.stack.window(n)
+        result = func(items)    # Before popping, in case it raises
+        self.stack.popn(len(items))
+        self.stack.extend(result)
+
+    def sort(self, n):
+        """
+    Usage: n sort
+
+    Sorts the top n items on the stack (all of them if n is 0) so that
+    the largest is on top (in x).  Integers, rationals and reals can be
+    mixed; they are compared exactly and equal values keep their order.
+        """
+        self.Reorder(n, lambda items: sorted(items, key=sort_key))
+
+    def rsort(self, n):
+        """
+    Usage: n rsort
+
+    Like sort, but puts the smallest item on top (in x) and the largest
+    deepest.  Equal values keep their order.
+        """
+        self.Reorder(n, lambda items: sorted(items, key=sort_key,
+                                             reverse=True))
+
+    def uniq(self, n):
+        """
+    Usage: n uniq
+
+    Removes items from the top n of the stack (all of them if n is 0)
+    that are equal to an item deeper in those n, so each value is kept at
+    its deepest position and the rest keep their order.  1, 1/1 and 1.0
+    are the same value.
+        """
+        def unique(items):
+            seen = set()
+            result = []
+            for x in items:
+                v = exact_value(x)
+                if v not in seen:
+                    seen.add(v)
+                    result.append(x)
+            return result
+        self.Reorder(n, unique)
+
+    def reverse(self, n):
+        """
+    Usage: n reverse
+
+    Reverses the order of the top n items on the stack (all of them if
+    n is 0).
+        """
+        self.Reorder(n, lambda items: items[::-1])
+
+    def StatWindow(self, n):
+        '''Check n for the statistics functions and return the number of
+        items they work on.
+        '''
+        if not isint(n) or n < 0:
+            raise ValueError("%sn must be an integer >= 0" % fln())
+        n = int(n)
+        if n > len(self.stack):
+            raise ValueError("%sStack size is only %d" % (fln(), len(self.stack)))
+        if not n:
+            n = len(self.stack)
+        if not n:
+            raise ValueError("%sStack is empty" % fln())
+        return n
+
+    def StatResult(self, v):
+        # Exact results are ints or Fractions
+        if isinstance(v, Fraction):
+            if v.denominator == 1:
+                return Zn(v.numerator)
+            if self.cfg["no_rationals"]:
+                return m.mpf(v.numerator)/v.denominator
+            return Rational(v.numerator, v.denominator)
+        return v
+
+    def Moments(self, n):
+        moments = Moments()
+        for x in self.stack.iterwindow(self.StatWindow(n)):
+            moments.add(x)
+        return moments
+
+    def mean(self, n):
+        """
+    Usage: n mean
+
+    Returns the mean of the top n items on the stack (all of them if n
+    is 0), leaving them on the stack.  The mean of integers and rationals
+    is exact; reals are averaged in one pass with Welford's method.
+        """
+        return self.StatResult(self.Moments(n).mean())
+
+    def var(self, n):
+        """
+    Usage: n var
+
+    Returns the sample variance (dividing by n - 1) of the top n items
+    on the stack (all of them if n is 0), leaving them on the stack.  It is
+    exact for integers and rationals.
+        """
+        return self.StatResult(self.Moments(n).variance())
+
+    def sdev(self, n):
+        """
+    Usage: n sdev
+
+    Returns the sample standard deviation of the top n items on the
+    stack (all of them if n is 0), leaving them on the stack.
+        """
+        v = self.Moments(n).variance()
+        if isinstance(v, Fraction):
+            v = m.mpf(v.numerator)/v.denominator
+        return m.sqrt(v)
+
+    def min(self, n):
+        """
+    Usage: n min
+
+    Pushes a copy of the smallest of the top n items on the stack (all
+    of them if n is 0).
+        """
+        return min(self.stack.iterwindow(self.StatWindow(n)), key=sort_key)
+
+    def max(self, n):
+        """
+    Usage: n max
+
+    Pushes a copy of the largest of the top n items on the stack (all of
+    them if n is 0).
+        """
+        return max(self.stack.iterwindow(self.StatWindow(n)), key=sort_key)
+
+    def median(self, n):
+        """
+    Usage: n median
+
+    Returns the median of the top n items on the stack (all of them if
+    n is 0), leaving them on the stack.  For an even number of items it is
+    the mean of the middle two.  It is found by selection, without sorting.
+        """
+        values = self.stack.window(self.StatWindow(n))
+        return self.StatResult(quantile(values, Fraction(1, 2)))
+
+    def quantile(self, n, p):
+        """
+    Usage: n p quantile
+
+    Returns the p quantile (0 <= p <= 1) of the top n items on the stack
+    (all of them if n is 0), leaving them on the stack.  It interpolates
+    between the nearest two items, as spreadsheets do:  0 gives the
+    smallest, 1/2 the median and 1 the largest.
+        """
+        values = self.stack.window(self.StatWindow(n))
+        return self.StatResult(quantile(values, p))
+
+    def hist(self, line=''):
+        """
+    Usage: hist nbins [n] [push]
+           hist [e0, e1, ...] [n] [push]
+
+    Counts the top n items on the stack (all of them if n is 0) in
+    nbins equal bins from the smallest to the largest, or in the bins
+    between the given edges, and shows the counts as a bar chart.  With
+    push, the counts are pushed instead, the first bin deepest.  A bin
+    holds its lower edge; the last one holds its upper edge too.
+        """
+        usage = "%sUsage: hist nbins|[e0, e1, ...] [n] [push]"
+        edges = None
+        line = line.strip()
+        if line.startswith("["):
+            end = line.find("]")
+            if end < 0:
+                raise ValueError(usage % fln())
+            edges = []
+            for field in line[1:end].replace(",", " ").split():
+                x = self.number(field)
+                if x is None:
+                    raise ValueError("%s'%s' is not a number" % (fln(), field))
+                edges.append(exact_value(x))
+            if len(edges) < 2:
+                raise ValueError("%sNeed at least two edges" % fln())
+            for a, b in zip(edges, edges[1:]):
+                if a >= b:
+                    raise ValueError("%sThe edges must increase" % fln())
+            args = line[end + 1:].split()
+        else:
+            args = line.split()
+            if not args or not integer.match(args[0]) or int(args[0]) < 1:
+                raise ValueError(usage % fln())
+            nbins = int(args.pop(0))
+        n, push = 0, False
+        for arg in args:
+            if arg == "push":
+                push = True
+            elif integer.match(arg) and int(arg) >= 0:
+                n = int(arg)
+            else:
+                raise ValueError(usage % fln())
+        n = self.StatWindow(n)
+        # Each item is converted once, to the key used to bisect the edges
+        keys = imap(sort_key, self.stack.iterwindow(n))
+        if edges is None:
+            keys = list(keys)
+            edges = bin_edges(keys, nbins)
+        counts, below, above = histogram(keys, edges)
+        if push:
+            self.stack.extend([Zn(c) for c in counts])
+            return
+        self.HistChart(edges, counts)
+        if below or above:
+            self.display.msg("%d below and %d above the edges" % (below, above))
+
+    def HistChart(self, edges, counts):
+        '''Show one line per bin with its range, count and a bar scaled so
+        the largest count fills the line.
+        '''
+        labels = []
+        for e in edges:
+            if isinstance(e, Fraction) and e.denominator > 1000:
+                e = to_mpf(e)
+            labels.append(self.Format(self.StatResult(e)).strip())
+        lw = max([len(x) for x in labels])
+        cw = len(str(max(counts)))
+        width = max(1, self.cfg["line_width"] - 2*lw - cw - 6)
+        most = max(max(counts), 1)
+        for i, count in enumerate(counts):
+            bar = "#"*((count*width + most - 1)//most)
+            self.display.msg("%*s %*s %*d %s" % (lw, labels[i], lw,
+                labels[i + 1], cw, count, bar))
+
+    def splus(self, y, x):
+        """
+    Usage: y x s+
+
+    Adds the point (x, y) to the summation registers.  They keep only
+    the number of points and the sums of x, y, x**2, y**2 and x*y, so any
+    number of points can be streamed through them (e.g. with -s); the
+    sums are exact for integers and rationals.  Use 0 for y if you only
+    have x values.  See smean, ssdev, slope, yint, corr and fcst.
+        """
+        self.sums.add(x, y)
+
+    def sminus(self, y, x):
+        """
+    Usage: y x s-
+
+    Removes the point (x, y) from the summation registers, e.g. to undo
+    an s+ of a wrong point.
+        """
+        self.sums.add(x, y, -1)
+
+    def sclr(self):
+        """
+    Usage: sclr
+
+    Clears the summation registers.
+        """
+        self.sums.clear()
+
+    def sn(self):
+        """
+    Usage: sn
+
+    Pushes the number of points in the summation registers.
+        """
+        return Zn(self.sums.n)
+
+    def smean(self):
+        """
+    Usage: smean
+
+    Pushes the mean of the y values, then the mean of the x values, of
+    the points in the summation registers.
+        """
+        x, y = self.sums.mean()
+        return [self.StatResult(y), self.StatResult(x)]
+
+    def ssdev(self):
+        """
+    Usage: ssdev
+
+    Pushes the sample standard deviation of the y values, then that of
+    the x values, of the points in the summation registers.
+        """
+        x, y = self.sums.sdev()
+        return [y, x]
+
+    def slope(self):
+        """
+    Usage: slope
+
+    Returns the slope of the least squares line through the points in the
+    summation registers.
+        """
+        return self.StatResult(self.sums.line()[0])
+
+    def yint(self):
+        """
+    Usage: yint
+
+    Returns the y intercept of the least squares line through the points
+    in the summation registers.
+        """
+        return self.StatResult(self.sums.line()[1])
+
+    def corr(self):
+        """
+    Usage: corr
+
+    Returns the correlation coefficient of the points in the summation
+    registers.
+        """
+        return self.sums.corr()
+
+    def fcst(self, x):
+        """
+    Usage: x fcst
+
+    Returns the y value at x on the least squares line through the points
+    in the summation registers.
+        """
+        slope, yint = self.sums.line()
+        v = exact(x)
+        if v is None:
+            x = real(x)
+        elif not isinstance(slope, m.mpf):
+            return self.StatResult(yint + slope*v)
+        return to_mpf(yint) + to_mpf(slope)*to_mpf(x)
+
     ############################################################################
     # Casting and converting functions
     ############################################################################
@@ -1811,6 +2462,15 @@ class Calculator(object):
         """
         return self.Cast(x, MPI)
 
+    def Cast_x(self, x):
+        """
+    Usage: x fixed
+
+    Returns x casted as a fixed point value in the current format (see
+    fixmode)
+        """
+        return self.Cast(x, FIX)
+
     def cast(self, x):
         """
     Usage: x cast
@@ -2002,6 +2662,19 @@ class Calculator(object):
             raise TypeError("operands to lcd must be integers")
         return self.multiply(y, x)/self.gcf(y, x)
 
+    def limitden(self, y, x):
+        """
+    Usage: y x limitden
+
+    Returns the rational closest to y whose denominator is no more than x.
+    A real y is used at its exact binary value.
+        """
+        if not isint(x):
+            raise ValueError("%sx must be an integer >= 1" % fln())
+        if isinstance(y, Julian):
+            y = y.to_mpf()
+        return limit_denominator(y, x)
+
     def Chop(self, x):
         """
     Usage: x chop
@@ -2023,6 +2696,7 @@ class Calculator(object):
                 self.cfg["fp_digits"] = mp.dps
             if self.fp.num_digits > mp.dps:
                 self.fp.digits(mp.dps)
+            self.FormatChanged()
             return None
         else:
             self.display.msg("You must supply an integer > 0")
@@ -2038,6 +2712,7 @@ class Calculator(object):
                 d = min(int(x), mp.dps)
                 self.cfg["fp_digits"] = d
                 self.fp.digits(min(int(x), mp.dps))
+                self.FormatChanged()
                 return None
             else:
                 self.display.msg("Use an integer >= 0")
@@ -2106,6 +2781,7 @@ class Calculator(object):
         else:
             self.cfg["mixed_fractions"] = False
             Rational.mixed = False
+        self.FormatChanged()
 
     def Debug(self, x):
         """
@@ -2156,6 +2832,7 @@ class Calculator(object):
         else:
             self.cfg["fp_comma_decorate"] = False
         mpFormat.comma_decorate = self.cfg["fp_comma_decorate"]
+        self.FormatChanged()
 
     def width(self, x):
         """
@@ -2165,6 +2842,7 @@ class Calculator(object):
         """
         if isint(x) and x > 20:
             self.cfg["line_width"] = int(x)
+            self.FormatChanged()
         else:
             self.display.msg("width command requires an integer > 20")
 
@@ -2175,6 +2853,7 @@ class Calculator(object):
     Set rectangular mode for display of complex numbers and vectors
         """
         self.cfg["imaginary_mode"] = "rect"
+        self.FormatChanged()
 
     def Polar(self):
         """
@@ -2183,6 +2862,7 @@ class Calculator(object):
     Set polar mode for display of complex numbers and vectors
         """
         self.cfg["imaginary_mode"] = "polar"
+        self.FormatChanged()
 
     def fix(self):
         """
@@ -2191,6 +2871,7 @@ class Calculator(object):
     Set fixed-point mode for display of floating point numbers
         """
         self.cfg["fp_format"] = "fix"
+        self.FormatChanged()
 
     def sig(self):
         """
@@ -2199,6 +2880,7 @@ class Calculator(object):
     Set significant digits mode for display of floating point numbers
         """
         self.cfg["fp_format"] = "sig"
+        self.FormatChanged()
 
     def sci(self):
         """
@@ -2207,6 +2889,7 @@ class Calculator(object):
     Set scientific mode for display of floating point numbers
         """
         self.cfg["fp_format"] = "sci"
+        self.FormatChanged()
 
     def eng(self):
         """
@@ -2215,6 +2898,7 @@ class Calculator(object):
     Set engineering mode for display of floating point numbers
         """
         self.cfg["fp_format"] = "eng"
+        self.FormatChanged()
 
     def engsi(self):
         """
@@ -2223,6 +2907,7 @@ class Calculator(object):
     Set engineering mode for display of floating point numbers
         """
         self.cfg["fp_format"] = "engsi"
+        self.FormatChanged()
 
     def raw(self):
         """
@@ -2231,6 +2916,7 @@ class Calculator(object):
     Set raw mode for display of floating point numbers
         """
         self.cfg["fp_format"] = "none"
+        self.FormatChanged()
 
     def dec(self):
         """
@@ -2239,6 +2925,7 @@ class Calculator(object):
     Set decimal mode for display of integers
         """
         self.cfg["integer_mode"] = "dec"
+        self.FormatChanged()
 
     def hex(self):
         """
@@ -2247,6 +2934,7 @@ class Calculator(object):
     Set hexadecimal mode for display of integers
         """
         self.cfg["integer_mode"] = "hex"
+        self.FormatChanged()
 
     def oct(self):
         """
@@ -2255,6 +2943,7 @@ class Calculator(object):
     Set octal mode for display of integers
         """
         self.cfg["integer_mode"] = "oct"
+        self.FormatChanged()
 
     def bin(self):
         """
@@ -2263,6 +2952,7 @@ class Calculator(object):
     Set binary mode for display of integers
         """
         self.cfg["integer_mode"] = "bin"
+        self.FormatChanged()
 
     def roman(self):
         """
@@ -2271,6 +2961,7 @@ class Calculator(object):
     Set roman numeral mode for display of integers
         """
         self.cfg["integer_mode"] = "roman"
+        self.FormatChanged()
 
     def iva(self):
         """
@@ -2280,6 +2971,7 @@ class Calculator(object):
         """
         self.cfg["iv_mode"] = "a"
         Julian.interval_representation = "a"
+        self.FormatChanged()
 
     def ivb(self):
         """
@@ -2289,6 +2981,7 @@ class Calculator(object):
         """
         self.cfg["iv_mode"] = "b"
         Julian.interval_representation = "b"
+        self.FormatChanged()
 
     def ivc(self):
         """
@@ -2298,6 +2991,7 @@ class Calculator(object):
         """
         self.cfg["iv_mode"] = "c"
         Julian.interval_representation = "c"
+        self.FormatChanged()
 
     def on(self):
         """
@@ -2328,6 +3022,7 @@ class Calculator(object):
     passing them to the functions
         """
         self.cfg["angle_mode"] = "deg"
+        self.FormatChanged()
 
     def rad(self):
         """
@@ -2338,6 +3033,7 @@ class Calculator(object):
     to be already expressed in radians.
         """
         self.cfg["angle_mode"] = "rad"
+        self.FormatChanged()
 
     def Rationals(self, x):
         """
@@ -2385,6 +3081,314 @@ class Calculator(object):
     Clears all registers
         """
         self.registers = {}
+        self.register_bank = []
+
+    def bench(self, line=''):
+        """
+    Usage: bench "expr" n
+
+    Runs the RPN expression expr n times and shows the min, median and max
+    time per run and the net number of objects each run retained, such as
+    the values it left on the stack.  Temporaries freed during a run are
+    not counted.  Every run starts from a copy of the current stack, which
+    is left unchanged.
+        """
+        usage = '%sUsage: bench "expr" n'
+        try:
+            args = shlex.split(line)
+        except ValueError:
+            raise ValueError(usage % fln())
+        if len(args) == 1:
+            args.append("1")
+        if len(args) != 2 or not integer.match(args[1]) or int(args[1]) < 1:
+            raise ValueError(usage % fln())
+        expr, n = args[0], int(args[1])
+        snapshot = self.stack.snapshot()
+        errors, self.errors = self.errors, []
+        enabled = self.display.enabled
+        def setup():
+            self.stack.restore(snapshot)
+        def run():
+            self.execute(expr)
+        journal, self.stack.journal = self.stack.journal, None
+        self.display.off()
+        try:
+            # Make sure the expression works before timing it
+            run()
+            if self.errors:
+                raise ValueError("%sbench: %s" % (fln(), self.errors[0]))
+            result = Bench(run, n, setup)
+        finally:
+            self.display.enabled = enabled
+            self.stack.restore(snapshot)
+            self.stack.journal = journal
+            self.errors = errors
+        self.display.msg(str(result))
+
+    def load(self, line=''):
+        """
+    Usage: load file [column]
+
+    Pushes the numbers in file onto the stack in the order they appear.
+    They can be written any way you could type them, e.g. 0x1f, 3k or 1/3.
+    Fields are separated by whitespace, or by commas in a CSV file.  With
+    column, only that field (counting from 1) of each line is used.  In a
+    JSON lines file (.jsonl), the number is the "value" of each line.
+    Fields that are not numbers, such as headings, are skipped.
+        """
+        usage = "%sUsage: load file [column]"
+        try:
+            args = shlex.split(line)
+        except ValueError:
+            raise ValueError(usage % fln())
+        column = 0
+        if len(args) == 2 and integer.match(args[1]) and int(args[1]) > 0:
+            column = int(args[1])
+        elif len(args) != 1:
+            raise ValueError(usage % fln())
+        self.LoadFile(os.path.expanduser(args[0]), column)
+
+    def LoadFile(self, filename, column=0, chunk=10000):
+        '''Push the numbers in filename (only the column'th field of each
+        line if column is nonzero) onto the stack.  The file is read a line
+        at a time and the numbers pushed chunk at a time, so only the
+        numbers themselves are kept in memory.
+        '''
+        try:
+            f = open(filename, "rb")
+        except IOError, e:
+            raise ValueError("%sload: %s" % (fln(), e))
+        start = time.time()
+        count, lines, skipped, first_skipped = 0, 0, 0, 0
+        try:
+            first = f.readline()
+            f.seek(0)
+            if filename.lower().endswith(".jsonl") or first.startswith("{"):
+                rows = jsonl_rows(f)
+            elif filename.lower().endswith(".csv") or "," in first:
+                rows = csv.reader(f)
+            else:
+                rows = (line.split() for line in f)
+            values = []
+            for row in rows:
+                lines += 1
+                if column:
+                    row = row[column - 1:column]
+                for field in row:
+                    field = field.strip()
+                    if not field:
+                        continue
+                    try:
+                        x = self.number(field)
+                    except ValueError:
+                        x = None
+                    if x is None:
+                        skipped += 1
+                        if not first_skipped:
+                            first_skipped = lines
+                        continue
+                    values.append(x)
+                    if len(values) == chunk:
+                        self.stack.extend(values)
+                        count += chunk
+                        values = []
+            self.stack.extend(values)
+            count += len(values)
+        except csv.Error, e:
+            raise ValueError("%sload: %s line %d: %s" % (fln(), filename,
+                lines, e))
+        finally:
+            f.close()
+        elapsed = time.time() - start
+        rate = ""
+        if elapsed > 0:
+            rate = " (%d lines/s)" % (lines/elapsed)
+        self.display.msg("Loaded %d numbers from %d lines in %s%s" % (count,
+            lines, format_time(elapsed), rate))
+        if skipped:
+            self.display.msg("Skipped %d fields that are not numbers "
+                "(the first on line %d)" % (skipped, first_skipped))
+
+    def save(self, line=''):
+        """
+    Usage: save file [csv|jsonl|bin] [n] [repr|display]
+
+    Writes the stack, or only its top n entries, to file with the top of
+    the stack last.  The format defaults to the file's extension, or csv:
+        csv     one number per line
+        jsonl   one {"type": ..., "value": ...} object per line; the
+                value is a string unless a double holds it exactly
+        bin     each number as a little-endian 64-bit float
+    With repr (the default), csv and jsonl hold each number exactly, in a
+    form load reads back; display writes it the way the stack shows it.
+        """
+        usage = "%sUsage: save file [csv|jsonl|bin] [n] [repr|display]"
+        try:
+            args = shlex.split(line)
+        except ValueError:
+            raise ValueError(usage % fln())
+        if not args:
+            raise ValueError(usage % fln())
+        filename = os.path.expanduser(args[0])
+        fmt = os.path.splitext(filename)[1][1:].lower()
+        if fmt not in ("csv", "jsonl", "bin"):
+            fmt = "csv"
+        n, style = 0, "repr"
+        for arg in args[1:]:
+            if arg in ("csv", "jsonl", "bin"):
+                fmt = arg
+            elif arg in ("repr", "display"):
+                style = arg
+            elif integer.match(arg) and int(arg) >= 0:
+                n = int(arg)
+            else:
+                raise ValueError(usage % fln())
+        self.SaveFile(filename, fmt, n, style)
+
+    def SaveFile(self, filename, fmt="csv", n=0, style="repr"):
+        '''Write the top n entries of the stack (all if n is 0) to
+        filename one at a time.  The file is written under a temporary
+        name and renamed when complete, so a failure leaves any existing
+        file alone.
+        '''
+        if style == "display":
+            text = lambda x: self.Format(x).strip()
+        else:
+            text = exact_str
+        start = time.time()
+        tmp = filename + ".tmp"
+        try:
+            f = open(tmp, "wb")
+        except IOError, e:
+            raise ValueError("%ssave: %s" % (fln(), e))
+        count = 0
+        try:
+            if fmt == "csv":
+                writer = csv.writer(f)
+                for x in self.stack.iterwindow(n):
+                    writer.writerow([text(x)])
+                    count += 1
+            elif fmt == "jsonl":
+                for x in self.stack.iterwindow(n):
+                    f.write('{"type": "%s", "value": %s}\n' % (
+                        type(x).__name__, json_value(text(x))))
+                    count += 1
+            else:
+                pack = struct.Struct("<d").pack
+                for x in self.stack.iterwindow(n):
+                    if isinstance(x, (mpc, ctx_iv.ivmpf)):
+                        raise ValueError("%ssave: bin only holds real numbers"
+                            % fln())
+                    f.write(pack(float(Convert(x, MPF))))
+                    count += 1
+            f.close()
+            if sys.platform == "win32" and os.path.exists(filename):
+                os.remove(filename)
+            os.rename(tmp, filename)
+        except:
+            f.close()
+            os.remove(tmp)
+            raise
+        self.display.msg("Saved %d entries to %s in %s" % (count, filename,
+            format_time(time.time() - start)))
+
+    def mem(self, line=''):
+        """
+    Usage: mem [n]
+           mem trace [on|off|clear]
+
+    Shows the memory used by the stack, the registers and the factorial
+    cache, and the n (default 5) largest entries.  Sizes include the
+    digits of big integers and the mantissas of reals.  Entries packed
+    into arrays (see pack) are shown as one line; entries spilled to disk
+    (see spill) are shown separately and are not in the total.
+
+    'mem trace on' records the net allocation of every command run after
+    it; 'mem trace' shows what was recorded.
+        """
+        args = line.split()
+        if args and args[0] == "trace":
+            if len(args) == 1:
+                self.display.msg(str(self.tracer))
+            elif args[1] == "on":
+                self.tracer.start()
+            elif args[1] == "off":
+                self.tracer.stop()
+            elif args[1] == "clear":
+                self.tracer.clear()
+            else:
+                raise ValueError("%sUsage: mem trace [on|off|clear]" % fln())
+            return
+        count = 5
+        if args:
+            if not integer.match(args[0]) or int(args[0]) < 0:
+                raise ValueError("%sUsage: mem [n]" % fln())
+            count = int(args[0])
+        entries = []    # (size, name, value)
+        n = len(self.stack.stack)   # Entries in memory
+        stack_total = 0
+        for i, x in enumerate(self.stack.stack):
+            size = sizeof(x)
+            stack_total += size
+            entries.append((size, "%d:" % (n - i), x))
+        register_total = sys.getsizeof(self.register_bank)
+        for name, x in chain(self.registers.iteritems(),
+                             enumerate(self.register_bank)):
+            size = sizeof(x)
+            register_total += size
+            entries.append((size, name, x))
+        cache_total = sizeof(self.factorial_cache)
+        others = [s for s in self.stacks.itervalues() if s is not self.stack]
+        others_n, others_total = 0, 0
+        for stack in others:
+            others_n += len(stack.stack)
+            others_total += sum([sizeof(x) for x in stack.stack])
+        # Undo only costs what it keeps that is no longer on a stack
+        on_stack = set()
+        for stack in self.stacks.itervalues():
+            on_stack.update([id(x) for x in stack.stack])
+        levels = self.undo_history + self.redo_history
+        undo_total = 0
+        for level in levels:
+            for stack, journal in level:
+                undo_total += sys.getsizeof(journal) + \
+                    sum([sys.getsizeof(entry) for entry in journal])
+                for x in stack.journal_values(journal):
+                    if id(x) not in on_stack:
+                        undo_total += sizeof(x)
+        lines = [
+            "stack           %8d entries %12d bytes" % (n, stack_total),
+            "registers       %8d entries %12d bytes" % (len(self.registers) +
+                len(self.register_bank), register_total),
+            "factorial cache %8d entries %12d bytes" % (
+                len(self.factorial_cache), cache_total),
+            "undo/redo       %8d levels  %12d bytes" % (len(levels),
+                undo_total),
+            "total                            %12d bytes" % (stack_total +
+                others_total + register_total + cache_total + undo_total),
+        ]
+        if others:
+            lines.insert(1, "other stacks    %8d entries %12d bytes" % (
+                others_n, others_total))
+        spilled = [s.spill for s in self.stacks.itervalues() if s.spill]
+        packed = [f for f in spilled if isinstance(f, PackedStore)]
+        spilled = [f for f in spilled if not isinstance(f, PackedStore)]
+        if packed:
+            packed_total = sum([f.nbytes() for f in packed])
+            lines.insert(-1, "packed          %8d entries %12d bytes" % (
+                sum([len(f) for f in packed]), packed_total))
+            lines[-1] = "total                            %12d bytes" % (
+                stack_total + others_total + register_total + cache_total +
+                undo_total + packed_total)
+        if spilled:
+            lines.append("spilled to disk %8d entries %12d bytes" % (
+                sum([len(f) for f in spilled]), sum([f.size for f in spilled])))
+        if count and entries:
+            lines.append("Largest entries:")
+            for size, name, x in heapq.nlargest(count, entries,
+                                                key=lambda e: e[0]):
+                lines.append("  %8s %10d bytes  %s" % (name, size, describe(x)))
+        self.display.msg("\n".join(lines))
 
     def ShowConfig(self):
         """
@@ -2415,13 +3419,15 @@ class Calculator(object):
         iv = self.cfg["iv_mode"]
         cdiv = d[self.cfg["C_division"]]
         dbg = d[get_debug()]
+        fx = "%s %s %s" % (Fixed.mode, Fixed.rounding, Fixed.overflow)
         if 1:
             s = '''Configuration:
       Stack:%(st)s    Commas:%(cd)s   +sign:%(sps)s   Allow divide by zero:%(adz)s
       iv%(iv)s    brief:%(br)s  C-type integer division:%(cdiv)s   Rationals:%(nr)s
       Line width:%(lw)s    Mixed fractions:%(mf)s     Downcasting:%(dc)s
       Complex numbers:  %(imm)s    arguments:%(af)s %(ad)s digits Debug:%(dbg)s
-      Display: %(fmt)s %(dig)s digits   prec:%(pr)s  Integers:%(im)s  Angles:%(am)s''' \
+      Display: %(fmt)s %(dig)s digits   prec:%(pr)s  Integers:%(im)s  Angles:%(am)s
+      Fixed point: %(fx)s''' \
         % locals()
 
         self.display.msg(s)
@@ -2436,6 +3442,7 @@ class Calculator(object):
             self.cfg["brief"] = True
         else:
             self.cfg["brief"] = False
+        self.FormatChanged()
 
     ############################################################################
     # End of callback functions
@@ -2453,7 +3460,7 @@ class Calculator(object):
         items = list(self.stack.pop())
         if not n:
             n = len(items)
-        self.stack.stack += items[:n]
+        self.stack.extend(items[:n])
 
     def ConfigChanged(self):
         try:
@@ -2473,6 +3480,14 @@ class Calculator(object):
             mp.dps = self.cfg["prec"]
         else:
             raise ValueError("%s'prec' value in configuration is bad" % fln())
+        self.FormatChanged()
+        self.SpillChanged()
+
+    def FormatChanged(self):
+        '''Call this whenever something that changes how numbers are
+        formatted is set; it makes DisplayStack reformat cached entries.
+        '''
+        self.format_generation += 1
 
     def GetFullPath(self, s):
         '''If s doesn't have a slash in it, prepend it with the directory where
@@ -2492,19 +3507,19 @@ class Calculator(object):
             if c:
                 try:
                     p = GetFullPath(c)
-                    WriteDictionary(p, "self.cfg", self.cfg)
+                    self.WriteDictionary(p, "self.cfg", self.cfg)
                 except:
                     self.display.msg(msg % (fln(), "config", p))
             if r:
                 try:
                     p = GetFullPath(r)
-                    WriteDictionary(p, "registers", self.registers)
+                    self.WriteDictionary(p, "registers", self.registers)
                 except:
                     self.display.msg(msg % (fln(), "registers", p))
             if s:
                 try:
                     p = GetFullPath(s)
-                    WriteList(p, "mystack", self.stack.stack)
+                    self.WriteStacks(p)
                 except:
                     self.display.msg(msg % (fln(), "stack", p))
 
@@ -2515,6 +3530,7 @@ class Calculator(object):
         '''
         try:
             self.cfg["line_width"] = int(os.environ["COLUMNS"]) - 1
+            self.FormatChanged()
         except:
             pass
 
@@ -2553,8 +3569,14 @@ class Calculator(object):
                     d = {}
                     p = GetFullPath(s)
                     execfile(p, d, d)
-                    global stack
-                    self.stack.stack = d["mystack"]
+                    self.stack.restore(d["mystack"])
+                    # Files from before named stacks only have mystack
+                    for name, items in d.get("mystacks", {}).iteritems():
+                        self.stacks[name] = Stack()
+                        self.stacks[name].restore(items)
+                    name = d.get("mystack_name", "main")
+                    self.stacks[name] = self.stack
+                    self.stack_name = name
                 except:
                     msg = "%sCould not read and execute stack file:" % fln() + \
                           nl + "  " + s
@@ -2563,7 +3585,18 @@ class Calculator(object):
     def DisplayStack(self):
         size = self.cfg["stack_display"]
         assert size >= 0 and isint(size)
-        stack = self.stack._string(self.Format, size)
+        # Only the entries shown this time are kept in the new cache, so
+        # it never holds more than one screenful of values alive.
+        cache, self.format_cache = self.format_cache, {}
+        generation = self.format_generation
+        def format(x, item_is_x=True):
+            entry = cache.get(id(x))
+            if entry is None or entry[0] is not x or \
+               entry[1] != generation or entry[2] != item_is_x:
+                entry = (x, generation, item_is_x, self.Format(x, item_is_x))
+            self.format_cache[id(x)] = entry
+            return entry[3]
+        stack = self.stack._string(format, size)
         if len(stack) > 0:
             self.display.msg(stack)
         if self.cfg["modulus"] != 1:
@@ -2610,6 +3643,18 @@ class Calculator(object):
         stack_header_allowance = 5
         if isinstance(x, ipaddr):
             s = str(x)
+        elif isinstance(x, Fixed):
+            if im == "hex":
+                s = hex(x)
+            elif im == "oct":
+                s = oct(x)
+            elif im == "bin":
+                s = x.bin()
+            else:
+                s = str(x)
+            if brief:
+                s = self.EllipsizeString(s, width - stack_header_allowance, e)
+            return s
         elif isint(x):
             if isint_native(x):
                 x = Zn(x)
@@ -2795,15 +3840,23 @@ class Calculator(object):
             return str(x)
         return s
 
-    def WriteList(self, filename, name, list):
+    def WriteList(self, filename, name, list, append=False):
+        '''Write list to filename as python source assigning it to name.
+        With append, it is added to the end of the file, after the imports
+        an earlier call wrote.
+        '''
         try:
-            f = open(filename, "wb")
+            if append:
+                f = open(filename, "ab")
+            else:
+                f = open(filename, "wb")
             p = f.write
-            p("from mpmath import *" + nl)
-            p("from rational import Rational" + nl)
-            p("from integer import Zn" + nl)
-            p("from julian import Julian" + nl)
-            p("mp.dps = " + str(mp.dps) + nl + nl)
+            if not append:
+                p("from mpmath import *" + nl)
+                p("from rational import Rational" + nl)
+                p("from integer import Zn" + nl)
+                p("from julian import Julian" + nl)
+                p("mp.dps = " + str(mp.dps) + nl + nl)
             p(name + " = [" + nl)
             indent = "  "
             for item in list:
@@ -2817,6 +3870,27 @@ class Calculator(object):
             self.display.msg(msg)
             raise
 
+    def WriteStacks(self, filename):
+        '''Write the stack in use as mystack and the other named stacks as
+        the dictionary mystacks.
+        '''
+        self.WriteList(filename, "mystack", self.stack)
+        try:
+            f = open(filename, "ab")
+            f.write('mystack_name = "' + self.stack_name + '"' + nl)
+            f.write("mystacks = {}" + nl)
+            f.close()
+        except Exception, e:
+            msg = ("%sError trying to write stacks:" % fln()) + nl + str(e)
+            self.display.msg(msg)
+            raise
+        names = self.stacks.keys()
+        names.sort()
+        for name in names:
+            if name != self.stack_name:
+                self.WriteList(filename, 'mystacks["' + name + '"]',
+                               self.stacks[name], append=True)
+
     def WriteDictionary(self, filename, name, dictionary):
         try:
             f = open(filename, "wb")
@@ -2845,17 +3919,22 @@ class Calculator(object):
         """
     Usage: regs
 
-    Displays the contents of the registers
+    Displays the contents of the registers.  The indexed registers are
+    shown as [0], [1], ...:  x sto[i] copies x to register i, rcl[i]
+    pushes it, and sto[i:j] and rcl[i:j] store or push registers i to
+    j - 1 in one step.
         """
-        if not self.registers:
+        if not self.registers and not self.register_bank:
             raise ValueError("%sThere are no registers defined" % fln())
         names = self.registers.keys()
         names.sort()
-        lengths = [len(name) for name in names]
+        items = [(name, self.registers[name]) for name in names]
+        items += [("[%d]" % i, x) for i, x in enumerate(self.register_bank)]
+        lengths = [len(name) for name, x in items]
         fmt = "%%-%ds  %%s\n" % max(lengths)
         s = ""
-        for name in names:
-            s += fmt % (name, self.Format(self.registers[name]))
+        for name, x in items:
+            s += fmt % (name, self.Format(x))
         self.display.msg(s)
 
     def CheckEnvironment(self):
@@ -2918,6 +3997,33 @@ class Calculator(object):
         self.registers[name] = stack[0]
         return status_ok
 
+    def IndexedRegister(self, op, i, j=None):
+        '''Handle sto[i], rcl[i], sto[i:j] and rcl[i:j].  The bank is a
+        list that grows to hold the highest register stored; registers
+        below it that were never stored hold 0.  sto copies the top of the
+        stack (the top j - i items for a range, the deepest going to
+        register i) and rcl pushes them back in the same order.
+        '''
+        i = int(i)
+        if j is None:
+            j = i + 1
+        else:
+            j = int(j)
+        if j <= i:
+            raise ValueError("%sRegister range [%d:%d] is empty" % (fln(), i, j))
+        bank = self.register_bank
+        if op == "sto":
+            items = self.stack.window(j - i)
+            if len(items) < j - i:
+                raise IndexError("%sStack size is only %d" % (fln(), len(items)))
+            if j > len(bank):
+                bank.extend([Zn(0)]*(j - len(bank)))
+            bank[i:j] = items
+        elif j > len(bank):
+            raise ValueError("%sOnly %d registers are stored" % (fln(), len(bank)))
+        else:
+            self.stack.extend(bank[i:j])
+
     def C_int(self, cmd, val):
         try:
             n = int(val)
@@ -2930,17 +4036,47 @@ class Calculator(object):
                 msg = "%sInteger for int command must be > 0"
                 raise ValueError(msg % fln())
             Number.bits = n
-            Zn.num_bits = n
+            Zn.mode_bits = n
         else:
             Number.bits = 0
-            Zn.num_bits = 0
+            Zn.mode_bits = 0
         # TODO This is ugly and needs refactoring...
         if cmd == 's':
             Number.signed = True
-            Zn.is_signed = True
+            Zn.mode_signed = True
         else:
             Number.signed = False
-            Zn.is_signed = False
+            Zn.mode_signed = False
+        self.FormatChanged()
+
+    def fixmode(self, line=''):
+        """
+    Usage: fixmode [qM.N|uqM.N] [truncate|nearest|convergent] [wrap|saturate]
+
+    Sets the format of fixed point numbers made by the fixed command:
+    qM.N is signed with a sign bit, M integer bits and N fraction bits;
+    uqM.N is unsigned with M + N bits.  The format can also be given on
+    its own, e.g. q1.15.  Results are rounded by truncating (toward
+    -infinity), to nearest (half up) or convergent (half to even), and
+    results too big for their format either wrap or saturate.  With no
+    arguments, shows the current settings.
+        """
+        words = line.split()
+        for word in words:
+            if self.qformats.match(word):
+                m, n = word.lstrip("uq").split(".")
+                Fixed.mode = qformat(int(m), int(n), word[0] != "u")
+            elif word in Fixed.roundings:
+                Fixed.rounding = word
+            elif word in Fixed.overflows:
+                Fixed.overflow = word
+            else:
+                raise ValueError("%s'%s' is not a fixed point format, "
+                                 "rounding or overflow" % (fln(), word))
+        if not words:
+            self.display.msg("%s %s %s" % (Fixed.mode, Fixed.rounding,
+                                           Fixed.overflow))
+        self.FormatChanged()
 
     def C_sX(self, val):
         """
@@ -3051,13 +4187,16 @@ class Calculator(object):
         return self.stack.pop()
 
     def read_line(self, stream=None):
-        if stream:
-            s = stream.readline()
-        elif self.process_stdin:
-            s = sys.stdin.readline()
+        if stream or self.process_stdin:
+            line = (stream or sys.stdin).readline()
+            if not line:
+                raise EOFError
         else:
             try:
-                line = raw_input(self.cfg["prompt"])
+                prompt = self.cfg["prompt"]
+                if self.stack_name != "main":
+                    prompt = self.stack_name + prompt
+                line = raw_input(prompt)
             except KeyboardInterrupt:
                 print
                 sys.exit()
@@ -3085,9 +4224,8 @@ class Calculator(object):
             tags = tags[0][3]
         return ft
 
-    def token(self):
+    def token(self, line):
         # snag the next token from the line
-        line = self.read_line()
         # print "got new line: '%s'" % line
         success, taglist, next = TextTools.tag(line, self.parser)
         while self.chomp(line) != '':
@@ -3124,61 +4262,108 @@ class Calculator(object):
             args.insert(0, val)
         return args
 
-    def run(self):
+    def execute(self, line):
+        '''Execute the commands and numbers in line.  Returns the last
+        token processed.
+        '''
         isiterable = lambda obj: getattr(obj, '__iter__', False)
-        cints = regex.compile(r"[su][0-9]+")
+        arg = ''
+        for arg,tag,line in self.token(line):
+            # print arg,line,tag
+            if arg in ['help', '?']:
+                self.commands_dict['help'][0](line)
+                break
+            elif arg == "const":
+                cv = self.commands_dict['const'][0](line)
+                if cv is not None:
+                    self.push(cv)
+                break
+            elif arg in self.commands_dict:
+                if self.commands_dict[arg][1] == 'line':
+                    # The command takes the rest of the line as its arguments
+                    try:
+                        self.commands_dict[arg][0](line)
+                    except (ValueError, TypeError, IndexError), e:
+                        if debug():
+                            self.errors.append(traceback.format_exc())
+                        else:
+                            self.errors.append(str(e))
+                    break
+                try:
+                    args = self.prepare_args(arg, self.commands_dict[arg][1])
+                    if args:
+                        self.stack.lastx = args[-1]
+                    try:
+                        if self.tracer.enabled:
+                            retval = self.tracer.call(arg,
+                                self.commands_dict[arg][0], *args)
+                        else:
+                            retval = self.commands_dict[arg][0](*args)
+                    except (ValueError, TypeError), e:
+                        retval = args
+                        if debug():
+                            self.errors.append(traceback.format_exc())
+                        else:
+                            self.errors.append(str(e))
+                except (IndexError, TypeError), e:
+                    self.errors.append(str(e))
+                    continue
+                if not isiterable(retval):
+                    retval = [retval]
+                for v in retval:
+                    if v is not None:
+                        if isint_native(v):
+                            v = make_zn(v)
+                        self.push(v)
+            elif arg in ['null', 'nop']:
+                pass
+            elif self.register_ref.match(arg):
+                try:
+                    self.IndexedRegister(*self.register_ref.match(arg).groups())
+                except (ValueError, IndexError), e:
+                    self.errors.append(str(e))
+            elif self.cints.match(arg):
+                self.C_int(arg[0], arg[1:])
+            elif self.qformats.match(arg):
+                try:
+                    self.fixmode(arg)
+                except ValueError, e:
+                    self.errors.append(str(e))
+            else:
+                # this should be a number....
+                num = self.chomp(arg)
+                #print "num = '%s', arg = '%s'"%(num,arg)
+                if len(num) > 0:
+                    try:
+                        num = self.number(self.chomp(arg), tag)
+                        if num is not None:
+                            self.push(num)
+                        elif "fixed_number" in tag:
+                            raise ValueError
+                    except ValueError:
+                        self.errors.append("Invalid input: %s" % arg)
+        return arg
+
+    def run(self):
         while True:
-            arg = ''
             try:
-                for arg,tag,line in self.token():
-                    # print arg,line,tag
-                    if arg in ['help', '?']:
-                        self.commands_dict['help'][0](line)
-                        break
-                    elif arg == "const":
-                        cv = self.commands_dict['const'][0](line)
-                        if cv is not None:
-                            self.push(cv)
-                        break
-                    elif arg in self.commands_dict:
-                        try:
-                            args = self.prepare_args(arg, self.commands_dict[arg][1])
-                            try:
-                                retval = self.commands_dict[arg][0](*args)
-                            except (ValueError, TypeError), e:
-                                retval = args
-                                if debug():
-                                    self.errors.append(traceback.format_exc())
-                                else:
-                                    self.errors.append(str(e))
-                        except (IndexError, TypeError), e:
-                            self.errors.append(str(e))
-                            continue
-                        if not isiterable(retval):
-                            retval = [retval]
-                        for v in retval:
-                            if v is not None:
-                                if isint_native(v):
-                                    v = Zn(v)
-                                self.push(v)
-                    elif arg in ['null', 'nop']:
-                        pass
-                    elif cints.match(arg):
-                        self.C_int(arg[0], arg[1:])
-                    else:
-                        # this should be a number....
-                        num = self.chomp(arg)
-                        #print "num = '%s', arg = '%s'"%(num,arg)
-                        if len(num) > 0:
-                            try:
-                                num = self.number(self.chomp(arg), tag)
-                                if num is not None:
-                                    self.push(num)
-                            except ValueError:
-                                self.errors.append("Invalid input: %s" % arg)
-                if arg not in ['help', '?']:
+                line = self.read_line()
+                if self.cfg["undo_levels"]:
+                    self.StartUndo()
+                try:
+                    arg = self.execute(line)
+                finally:
+                    self.SaveUndo()
+                if self.process_stdin:
+                    # Batch input:  only show the stack at the end
+                    if self.errors:
+                        self.display.msg("\n".join(self.errors))
+                        self.errors = []
+                elif arg not in ['help', '?']:
                     self.DisplayStack()
             except EOFError:
+                if self.process_stdin:
+                    self.DisplayStack()
                 break
             except ParseError:
                 type,value,tb = sys.exc_info()
@@ -3271,18 +4456,20 @@ def ParseCommandLine():
     usage = "usage: %prog [options]"
     descr = "Command line RPN calculator"
     parser = OptionParser(usage, description=descr)
-    c,d,s,r,t,v = ("Check that commands have help info",
+    c,d,s,r,t,v,i = ("Check that commands have help info",
                    "Use default configuration in hc.py file only",
                    "Take input from stdin",
                    "Read input from file",
                    "Exit with status 1 if = or == are False",
-                   "Display program version")
+                   "Display program version",
+                   "Push the numbers in a file onto the stack")
     parser.add_option("-c", "--run-checks", action="store_true", help=c)
     parser.add_option("-d", "--default-config", action="store_true", help=d)
     parser.add_option("-s", "--read-stdin", action="store_true", help=s)
     parser.add_option("-r", "--read-file", dest="file", help=r)
     parser.add_option("-t", "--testing-mode", action="store_true", help=t)
     parser.add_option("-v", "--version", action="store_true", help=v)
+    parser.add_option("-i", "--input-file", dest="input_file", help=i)
     return parser.parse_args(args=None, values=None)
 
 def main(argv):
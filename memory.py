@@ -0,0 +1,169 @@
+'''
+Memory accounting for the values the calculator keeps around.
+
+---------------------------------------------------------------------------
+Copyright (c) 2011, Vernon Mauery
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or
+without modification, are permitted provided that the following
+conditions are met:
+
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following
+disclaimer in the documentation and/or other materials provided
+with the distribution.
+* The names of the contributors may not be used to endorse or
+promote products derived from this software without specific
+prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import gc
+import sys
+from mpmath import mpf, mpc, ctx_iv
+from numeric import Zn, Rational, Width, QFormat, isint_native
+
+# tracemalloc is only in python 3.4+ (or a patched 2.7 with pytracemalloc).
+# Without it, the allocation tracer counts net gc-tracked objects instead
+# of bytes.
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+def _sizeof_mpf_tuple(t):
+    # (sign, mantissa, exponent, bitcount); sign and bitcount are small
+    # cached ints.
+    return sys.getsizeof(t) + sys.getsizeof(t[1]) + sys.getsizeof(t[2])
+
+def sizeof(x):
+    '''Return the number of bytes used by x and the objects it owns:
+    the object itself plus its __dict__ or __slots__ values, the digits
+    of big integers and the mantissas of mpmath numbers.
+    '''
+    size = sys.getsizeof(x)
+    if isinstance(x, mpf):
+        return size + _sizeof_mpf_tuple(x._mpf_)
+    elif isinstance(x, mpc):
+        re, im = x._mpc_
+        return size + sys.getsizeof(x._mpc_) + _sizeof_mpf_tuple(re) + \
+            _sizeof_mpf_tuple(im)
+    elif isinstance(x, ctx_iv.ivmpf):
+        a, b = x._mpi_
+        return size + sys.getsizeof(x._mpi_) + _sizeof_mpf_tuple(a) + \
+            _sizeof_mpf_tuple(b)
+    elif isinstance(x, (int, long, float, str)):
+        return size
+    elif isinstance(x, (Width, QFormat)):
+        return 0    # Shared by every Zn or Fixed of that format
+    elif isinstance(x, (list, tuple)):
+        return size + sum([sizeof(i) for i in x])
+    elif isinstance(x, dict):
+        # Keys are usually interned strings or small ints; don't count them.
+        return size + sum([sizeof(i) for i in x.itervalues()])
+    for cls in type(x).__mro__:
+        for name in cls.__dict__.get("__slots__", ()):
+            if hasattr(x, name):
+                size += sizeof(getattr(x, name))
+    d = getattr(x, "__dict__", None)
+    if d is not None:
+        size += sizeof(d)
+    return size
+
+def describe(x):
+    '''Return a short string with the type of x and the size of its
+    digits, e.g. "Zn 70 bits" or "mpf 103-bit mantissa".
+    '''
+    name = type(x).__name__
+    if isinstance(x, Zn) or isint_native(x):
+        return "%s %d bits" % (name, abs(int(x)).bit_length())
+    elif isinstance(x, Rational):
+        return "%s %d/%d bits" % (name, abs(x.n).bit_length(), abs(x.d).bit_length())
+    elif isinstance(x, mpf):
+        return "%s %d-bit mantissa" % (name, x._mpf_[3])
+    elif isinstance(x, mpc):
+        re, im = x._mpc_
+        return "%s %d+%d-bit mantissas" % (name, re[3], im[3])
+    elif isinstance(x, ctx_iv.ivmpf):
+        a, b = x._mpi_
+        return "%s %d+%d-bit mantissas" % (name, a[3], b[3])
+    return name
+
+class AllocationTracer(object):
+    '''Records the net allocation of each command that is run through
+    call().  With tracemalloc this is in bytes; otherwise it is the net
+    number of gc-tracked objects (the collector is paused around each
+    command so the count is not reset in the middle of it).
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.stats = {}     # name : [calls, total, largest]
+        if tracemalloc is not None:
+            self.units = "bytes"
+        else:
+            self.units = "objects"
+
+    def start(self):
+        if tracemalloc is not None and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.enabled = True
+
+    def stop(self):
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.enabled = False
+
+    def clear(self):
+        self.stats = {}
+
+    def call(self, name, func, *args):
+        if tracemalloc is not None:
+            before = tracemalloc.get_traced_memory()[0]
+            try:
+                return func(*args)
+            finally:
+                self.record(name, tracemalloc.get_traced_memory()[0] - before)
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        before = gc.get_count()[0]
+        try:
+            return func(*args)
+        finally:
+            self.record(name, gc.get_count()[0] - before)
+            if gc_was_enabled:
+                gc.enable()
+
+    def record(self, name, delta):
+        if name not in self.stats:
+            self.stats[name] = [0, 0, delta]
+        s = self.stats[name]
+        s[0] += 1
+        s[1] += delta
+        s[2] = max(s[2], delta)
+
+    def __str__(self):
+        if not self.stats:
+            return "No commands traced"
+        names = self.stats.keys()
+        names.sort(key=lambda k: -self.stats[k][1])
+        width = max([len(n) for n in names])
+        fmt = "%%-%ds  %%8s  %%12s  %%12s" % width
+        lines = [fmt % ("command", "calls", "net " + self.units, "largest")]
+        for name in names:
+            calls, total, largest = self.stats[name]
+            lines.append(fmt % (name, calls, total, largest))
+        return "\n".join(lines)
@@ -34,13 +34,20 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 '''
 
 from mpmath import mpf, mpc, mpi, ctx_iv, eps, mp, pi
+from mpmath.libmp import to_str, repr_dps, to_float, round_nearest, \
+    from_man_exp, mpf_hash
 from mpformat import mpFormat, inf
 from debug import *
+import debug as debugging
 import socket
 import time
 import re
+from fractions import Fraction
+from math import ldexp
+from operator import truediv
 from string import strip
 from si import suffixes_ln
+import bigint
 
 try: from pdb import xx  # pdb.set_trace is xx; easy to find for debugging
 except: pass
@@ -52,130 +59,176 @@ def isint(x):
     return isinstance(x, (int, long, Zn))
 
 def gcd(a, b):
-    '''Determine the greatest common divisor of integers u and v.
-    Euclid's algorithm from Knuth, vol 2, pg 320.
+    '''Determine the greatest common divisor of integers u and v.  It
+    has the sign of b (see bigint.gcd).
     '''
     if not isint(a) or not isint(b):
         raise ValueError("Arguments must be integers")
-    a, b = int(a), int(b)
-    if a == 0:  return b
-    if b == 0:  return a
-    while b != 0:
-        a, b = b, a % b
-    return a
+    return bigint.gcd(int(a), int(b))
 
 class Rational(object):
+    '''The fraction n/d in lowest terms, with d > 0.  The result of adding,
+    subtracting, multiplying or dividing two of them is only put in
+    lowest terms when its n or d is looked at (to show it or compare it),
+    so a chain of arithmetic pays for one gcd at the end rather than one
+    per step.
+    '''
+    __slots__ = ("_n", "_d", "_reduced")
     mixed = False  # If set to true, str() returns mixed form
+
+    # A result is reduced right away if its denominator grows past this
+    # many bits, so an unreduced chain can't grow without bound.
+    lazy_bits = 1024
+
     def __init__(self, a=0, b=1):
         if b == 1:
             if isinstance(a, mpf):
                 r = self.frac(a)
-                self.n, self.d = r.n, r.d
+                self._n, self._d, self._reduced = r.n, r.d, True
+                return
+            elif isinstance(a, Rational):
+                # C++ copy constructor behavior
+                self._n, self._d, self._reduced = a._n, a._d, a._reduced
                 return
-            else:
-                try:
-                    # C++ copy constructor behavior
-                    self.n = a.numer()
-                    self.d = a.denom()
-                    return
-                except:
-                    pass
         if b == 0:
             raise ZeroDivisionError("Denominator is zero")
         else:
             g = gcd(a, b)
-            self.n = int(a)//g
-            self.d = int(b)//g
+            self._n = int(a)//g
+            self._d = int(b)//g
+            self._reduced = True
+
+    def __reduce__(self):
+        # __slots__ classes can't be pickled with protocols 0 and 1
+        return (Rational, (self.n, self.d))
+
+    def _reduce(self):
+        n, d = self._n, self._d
+        g = bigint.gcd(n, d)
+        if g != 1:
+            self._n, self._d = n//g, d//g
+        self._reduced = True
+
+    @property
+    def n(self):
+        "The numerator, in lowest terms"
+        if not self._reduced:
+            self._reduce()
+        return self._n
+
+    @property
+    def d(self):
+        "The denominator, in lowest terms"
+        if not self._reduced:
+            self._reduce()
+        return self._d
 
     def __abs__(self):
-        return Rational(abs(self.n), abs(self.d))
+        return _rational(abs(self._n), self._d, self._reduced)
 
     def __pos__(self):
         return Rational(self)
 
     def __neg__(self):
-        return Rational(-self.n, self.d)
+        return _rational(-self._n, self._d, self._reduced)
 
     def __radd__(self, other):
         return self.__add__(other)
 
     def __add__(self, other):
         if isinstance(other, Rational):
-            y = Rational(self.n*other.d + other.n*self.d, self.d*other.d)
-            if y.d == 1:
-                return y.n
+            if self._d == other._d:
+                n, d = self._n + other._n, self._d
             else:
-                return y
+                n = self._n*other._d + other._n*self._d
+                d = self._d*other._d
+            if n % d == 0:
+                return n//d
+            return _rational(n, d)
+        elif isint_native(other):
+            # Still in lowest terms if self was
+            n, d = other*self._d + self._n, self._d
+            if n % d == 0:
+                return n//d
+            return _rational(n, d, self._reduced)
         elif isinstance(other, float):
             raise ValueError("float addition not supported")
+        elif isinstance(other, Fixed):
+            return self.__add__(other.rational())
         else:
-            assert isinstance(other, int) or isinstance(other, mpf) or \
+            assert isinstance(other, mpf) or \
                    isinstance(other, mpc) or isinstance(other, ctx_iv.ivmpf)
-            n = other*self.d + self.n
-            if isinstance(n, int):
-                y = Rational(n, self.d)
-                if y.d == 1:
-                    return y.n
-                else:
-                    return y
-            else:
-                return n/self.d
+            return (other*self.d + self.n)/self.d
 
     def __rsub__(self, other):
         return -self.__sub__(other)
 
     def __sub__(self, other):
         if isinstance(other, Rational):
-            return Rational(self.n*other.d - other.n*self.d, self.d*other.d)
+            if self._d == other._d:
+                return _rational(self._n - other._n, self._d)
+            return _rational(self._n*other._d - other._n*self._d,
+                             self._d*other._d)
+        elif isint_native(other):
+            n, d = self._n - other*self._d, self._d
+            if n % d == 0:
+                return n//d
+            return _rational(n, d, self._reduced)
         elif isinstance(other, float):
             raise ValueError("float subtraction not supported")
+        elif isinstance(other, Fixed):
+            return self.__sub__(other.rational())
         else:
-            assert isinstance(other, int) or isinstance(other, mpf) or \
+            assert isinstance(other, mpf) or \
                    isinstance(other, mpc) or isinstance(other, ctx_iv.ivmpf)
-            n = self.n - other*self.d
-            if isinstance(n, int):
-                y = Rational(n, self.d)
-                if y.d == 1:
-                    return y.n
-                else:
-                    return y
-            else:
-                return n/self.d
+            return (self.n - other*self.d)/self.d
 
     def __rmul__(self, other):
         return self.__mul__(other)
 
     def __mul__(self, other):
         if isinstance(other, Rational):
-            return Rational(self.n*other.n, self.d*other.d)
+            return _rational(self._n*other._n, self._d*other._d)
+        elif isint(other):
+            n, d = int(other)*self._n, self._d
+            if n % d == 0:
+                return n//d
+            return _rational(n, d)
         elif isinstance(other, float):
             raise ValueError("float multiplication not supported")
+        elif isinstance(other, Fixed):
+            return self.__mul__(other.rational())
         else:
-            assert isint(other) or isinstance(other, mpf) or \
+            assert isinstance(other, mpf) or \
                    isinstance(other, mpc) or isinstance(other, ctx_iv.ivmpf)
-            n = other*self.n
-            if isinstance(n, int):
-                y = Rational(n, self.d)
-                if y.d == 1:
-                    return y.n
-                else:
-                    return y
-            else:
-                return n/self.d
+            return other*self.n/self.d
 
     def __rdiv__(self, other):
+        if isint(other) and other != 0:
+            if self._n == 0:
+                raise ZeroDivisionError("Divisor is zero")
+            n = int(other)
+            return _rational(n*self._d, self._n,
+                             self._reduced and (n == 1 or n == -1))
         one = Rational(1)
         return one/(self*(one/other))
 
     def __div__(self, other):
+        if isinstance(other, Rational):
+            if other._n == 0:
+                raise ZeroDivisionError("Divisor is zero")
+            # The reciprocal of a fraction in lowest terms is too
+            reduced = other._reduced and self._d == 1 and \
+                (self._n == 1 or self._n == -1)
+            return _rational(self._n*other._d, self._d*other._n, reduced)
         if other == 0:
             raise ZeroDivisionError("Divisor is zero")
-        if isinstance(other, Rational):
-            return Rational(self.n*other.d, self.d*other.n)
-        elif isint(other):
-            return Rational(self.n, self.d*int(other))
+        if isint(other):
+            return _rational(self._n, self._d*int(other))
         elif isinstance(other, float):
             raise ValueError("float division not supported")
+        elif isinstance(other, Fixed):
+            return self.__div__(other.rational())
         else:
             assert isinstance(other, mpf) or \
                    isinstance(other, mpc) or \
@@ -227,27 +280,68 @@ class Rational(object):
             raise AttributeError("'%s' not an attribute" % key)
 
     def __cmp__(self, other):
-        if other == None:
+        '''Compare exactly by cross multiplying; d is always positive, so
+        this doesn't need the fraction in lowest terms.  An mpf is
+        compared as the fraction man*2**exp.
+        '''
+        if other is None:
             return -1
+        n, d = self._n, self._d
         if isinstance(other, Rational):
-            if (self.n == other.n) and (self.d == other.d):
-                return 0
-            else:
-                if self.mpf() < other.mpf(): return -1
-                else: return 1
+            return cmp(n*other._d, other._n*d)
+        elif isint(other):
+            return cmp(n, int(other)*d)
+        elif isinstance(other, float):
+            try:
+                p, q = other.as_integer_ratio()
+            except (OverflowError, ValueError):
+                return cmp(float(self), other)  # inf or nan
+            return cmp(n*q, p*d)
         elif isinstance(other, mpf):
-            a, b = self.mpf(), other.mpf()
-            if a < b: return -1
-            elif a > b: return 1
-            else: return 0
-        elif isinstance(other, int):
-            a, b = self.mpf(), mpf(other)
-            if a < b: return -1
-            elif a > b: return 1
-            else: return 0
+            sign, man, exp, bc = other._mpf_
+            if sign:
+                man = -man
+            if not man and exp:
+                # inf, -inf or nan
+                a = self.mpf()
+                if a < other: return -1
+                elif a > other: return 1
+                else: return 0
+            if exp >= 0:
+                return cmp(n, (man << exp)*d)
+            return cmp(n << -exp, man*d)
+        elif isinstance(other, Fixed):
+            return -other.__cmp__(self)
         else:
             raise ValueError("Second argument is unsupported type")
 
+    # Defined so that the exact comparison is used rather than mpf's when
+    # a Rational is compared with an mpf.  This only holds with the
+    # Rational on the left:  with an mpf on the left, mpmath compares
+    # first, using the Rational's _mpf_, which is rounded to the current
+    # precision.  So mpf(1)/3 == Rational(1, 3) is True, but
+    # Rational(1, 3) == mpf(1)/3 is False.
+    def __eq__(self, other): return self.__cmp__(other) == 0
+    def __ne__(self, other): return self.__cmp__(other) != 0
+    def __lt__(self, other): return self.__cmp__(other) < 0
+    def __le__(self, other): return self.__cmp__(other) <= 0
+    def __gt__(self, other): return self.__cmp__(other) > 0
+    def __ge__(self, other): return self.__cmp__(other) >= 0
+
+    def __hash__(self):
+        '''Equal to the hash of an int, float or mpf that compares equal.
+        A power of 2 denominator is hashed as mpf hashes the same binary
+        value, which is the float's hash when there is an equal float.
+        (mpmath itself hashes an mpf holding an integer too big for a
+        float differently from the int; we match the int.)
+        '''
+        n, d = self.n, self.d
+        if d == 1:
+            return hash(n)
+        if not d & (d - 1):
+            return mpf_hash(from_man_exp(n, 1 - d.bit_length()))
+        return hash((n, d))
+
     def mpf(self):
         return mpf(self.n)/mpf(self.d)
 
@@ -266,30 +360,23 @@ class Rational(object):
 
     def frac(self, x, digits=0, max_iterations=0):
         '''Converts an mpf to a Rational approximation and returns a
-        Rational object.  The iteration goal is to return a rational
-        approximation whose difference from x is less than 1/10**mp.dps;
-        i.e., the approximation as good as the current number of digits
-        used in the mpmath library.
-
-        x will be converted to an mpf type.  This routine is converted from
-        a C routine I downloaded from NETLIB on Tue Nov 11 18:08:26 1997
-        from NIST Guide to Available Math Software, source for module FRAC
-        from package C.
+        Rational object.  The result is the simplest fraction (the one with
+        the smallest denominator) whose relative difference from x is no
+        more than 10**(-digits); if digits is 0, mp.dps is used.
 
-        digits sets the precision of the conversion at 10**(-digits).  If
-        it is 0, then mp.dps is used.
+        The work is done exactly on the integers of x's mantissa and
+        exponent:  the simplest fraction in the interval around x is found
+        by walking the continued fractions of its two ends down the
+        Stern-Brocot tree, so mp.dps is never changed and the cost is a
+        few integer operations per partial quotient.
 
         Set max_iterations to a postive nonzero value to limit the number
-        of iterations.
-
-        See http://gams.nist.gov/,
-        http://gams.nist.gov/serve.cgi/Package/C/,
-        http://www.netlib.org/c/frac (location of actual source)
+        of partial quotients.
         '''
         if isinstance(x, mpc) or isinstance(x, complex):
             x = abs(x)
         elif isinstance(x, ctx_iv.ivmpf):
-            x = x.mid
+            x = _iv_mid(x)
         elif isinstance(x, int) or isinstance(x, long):
             x = mpf(x)
         elif isinstance(x, Zn):
@@ -298,63 +385,111 @@ class Rational(object):
             if not isinstance(x, mpf):
                 # Note we explicitly do not handle floats
                 raise SyntaxError("Unsupported type")
-        # Handle a special case that results in no convergence.
-        if x == mpf("1")/mpf("2"):
-            return Rational(1, 2)
-        digits_increase = 2
         if digits == 0:
             digits = mp.dps
-        error = mpf(10)**(-digits)
-        # We'll increase the precision to ensure the error is greater
-        # than the minimal fractional digits.
-        mp.dps += digits_increase
+        p, q = _mpf_ratio(x)
         sign = 1
-        if x < 0:
-            sign = -1
-            x = abs(x)
-        if x == 0:
-            mp.dps -= digits_increase
+        if p < 0:
+            sign, p = -1, -p
+        if p == 0:
             return Rational(0, 1)
-        d, D, n, r, epsilon, iterations = 1, 1, int(x), mpf(1), mpf(0), 0
-        N = n + 1
-        one = True
-        while True:
-            iterations += 1
-            if max_iterations and iterations > max_iterations:
-                raise Exception("Too many iterations")
-            if not one:
-                if r > 1.0:
-                    N += n*int(r)
-                    D += d*int(r)
-                    n += N
-                    d += D
-                else:
-                    r = 1.0/r
-            else:
-                one = False
-            r = 0.0
-            if x*d != n:
-                r = (N - x*D)/(x*d - n)
-                if r <= 1.0:
-                    t = N
-                    N = n
-                    n = t
-                    t = D
-                    D = d
-                    d = t
-            epsilon = abs(1.0 - n/(x*d))
-            if epsilon <= error:
-                mp.dps -= digits_increase
-                return Rational(sign*n, d)
-            if r != 0.0:
-                continue
-            m = 10.0
-            while m*epsilon < 1.0:
-                m *= 10.0
-            epsilon = (1.0/m)*(int(0.5 + m*epsilon))
-            if r == 0.0:
-                mp.dps -= digits_increase
-                raise Exception("Error in frac() routine")
+        # x*(1 -/+ 10**-digits)
+        scale = 10**digits
+        n, d = _simplest_between(p*(scale - 1), q*scale, p*(scale + 1),
+                                 q*scale, max_iterations)
+        return _rational(sign*n, d, True)
+
+def _rational(n, d, reduced=False):
+    '''Make the Rational n/d without going through __init__.  Unless
+    reduced is true, it is put in lowest terms when it is first looked at.
+    '''
+    if d < 0:
+        n, d = -n, -d
+    r = object.__new__(Rational)
+    r._n, r._d, r._reduced = n, d, reduced
+    if not reduced and d.bit_length() > Rational.lazy_bits:
+        r._reduce()
+    return r
+
+def _mpf_ratio(x):
+    '''Return the mpf x as the exact fraction p/q, with q a power of 2.'''
+    sign, man, exp, bc = x._mpf_
+    if not man:
+        if exp:
+            raise ValueError("%s%s has no rational value" % (fln(), x))
+        return 0, 1
+    man = int(man)      # An mpz when mpmath is using gmpy
+    if sign:
+        man = -man
+    if exp >= 0:
+        return man << exp, 1
+    return man, 1 << -exp
+
+def _simplest_between(a, b, c, d, max_iterations=0):
+    '''Return (n, d) for the fraction with the smallest denominator in the
+    interval [a/b, c/d], where 0 < a/b <= c/d.  Each pass takes the next
+    partial quotient t shared by the continued fractions of both ends,
+    then continues on the reciprocals of what is left of them.
+    '''
+    p0, q0, p1, q1 = 0, 1, 1, 0    # The previous two convergents
+    iterations = 0
+    while True:
+        iterations += 1
+        if max_iterations and iterations > max_iterations:
+            raise ValueError("%sToo many iterations" % fln())
+        t, r = divmod(a, b)
+        if r and (t + 1)*d <= c:
+            t += 1      # An integer lies in the interval
+        elif r:
+            a, b, c, d = d, c - t*d, b, r
+            p0, q0, p1, q1 = p1, q1, t*p1 + p0, t*q1 + q0
+            continue
+        return t*p1 + p0, t*q1 + q0
+
+def _limit_denominator(n, d, max_d):
+    '''Return (p, q) for the fraction closest to n/d with 0 < q <= max_d.
+    The candidates are the last convergent of n/d with a small enough
+    denominator and the best semiconvergent after it.
+    '''
+    if d <= max_d:
+        return n, d
+    sign = 1
+    if n < 0:
+        sign, n = -1, -n
+    p0, q0, p1, q1 = 0, 1, 1, 0
+    a, b = n, d
+    while True:
+        t, r = divmod(a, b)
+        q2 = q0 + t*q1
+        if q2 > max_d:
+            break
+        p0, q0, p1, q1 = p1, q1, p0 + t*p1, q2
+        a, b = b, r
+    k = (max_d - q0)//q1
+    ps, qs = p0 + k*p1, q0 + k*q1
+    # |p1/q1 - n/d| <= |ps/qs - n/d|
+    if abs(p1*d - n*q1)*qs <= abs(ps*d - n*qs)*q1:
+        return sign*p1, q1
+    return sign*ps, qs
+
+def limit_denominator(x, max_d):
+    '''Return the Rational closest to x with a denominator of at most
+    max_d.  x may be an integer, Rational or mpf; an mpf is taken at its
+    exact binary value.
+    '''
+    max_d = int(max_d)
+    if max_d < 1:
+        raise ValueError("%sThe denominator limit must be at least 1" % fln())
+    if isint(x):
+        return Rational(int(x))
+    elif isinstance(x, Rational):
+        n, d = x.n, x.d
+    elif isinstance(x, mpf):
+        n, d = _mpf_ratio(x)
+    else:
+        raise ValueError("%sCan't limit the denominator of a %s" %
+                         (fln(), type(x).__name__))
+    return _rational(*_limit_denominator(n, d, max_d), reduced=True)
 
 if __name__ == "__main__":
     # Test code
@@ -587,20 +722,103 @@ Uns binary 2's comp
 def isint(x):
     return isinstance(x, int) or isinstance(x, long) or isinstance(x, Zn)
 
+class Width(object):
+    '''The constants for integers of a given number of bits, worked out
+    once per width; use width(bits) to get them.  Width 0 stands for
+    unlimited integers.
+    '''
+    __slots__ = ("bits", "base", "mask", "sign_bit", "min", "max",
+                 "hex_digits", "oct_digits")
+    def __init__(self, bits):
+        self.bits = bits
+        if bits:
+            self.base = 1 << bits
+            self.mask = self.base - 1
+            self.sign_bit = self.base >> 1
+        else:
+            self.base, self.mask, self.sign_bit = 0, -1, 0
+        self.min = -self.sign_bit       # Range of the signed values; the
+        self.max = self.sign_bit - 1    # unsigned ones are 0 to mask
+        self.hex_digits = (bits + 3)//4
+        self.oct_digits = (bits + 2)//3
+
+_widths = {}
+
+def width(bits):
+    '''Return the Width for integers of the given number of bits.'''
+    try:
+        return _widths[bits]
+    except KeyError:
+        w = _widths[bits] = Width(bits)
+        return w
+
+_unlimited = width(0)
+
+# A Zn is never changed once it is made, so small values can be shared:
+# make_zn returns the same object every time for a value from small_min
+# to small_max of a given width and signedness.
+small_min, small_max = -256, 1024
+_interned = {}      # bits << 1 | signed : list of Zn, filled as needed
+_small_unlimited = _interned[1] = [None]*(small_max - small_min + 1)
+
+def _new_zn(n, bits, signed, w):
+    # Make a Zn from a normalized n without going through __init__
+    z = object.__new__(Zn)
+    z.n, z.num_bits, z.is_signed, z.width = n, bits, signed, w
+    return z
+
+def make_zn(n, bits=None, signed=None):
+    '''Return a Zn for the int n, masked to bits and signed (by default
+    the integer mode).  Small values come from the intern table; use
+    Zn() instead to get a new object whose bits or signed can be set.
+    '''
+    if bits is None:
+        bits, signed = Zn.mode_bits, Zn.mode_signed
+    w = _widths.get(bits) or width(bits)
+    if bits:
+        n &= w.mask
+        if signed and n & w.sign_bit:
+            n -= w.base
+    else:
+        signed = True
+    if small_min <= n <= small_max:
+        key = bits << 1 | signed
+        table = _interned.get(key)
+        if table is None:
+            table = _interned[key] = [None]*(small_max - small_min + 1)
+        z = table[n - small_min]
+        if z is None:
+            z = table[n - small_min] = _new_zn(int(n), bits, signed, w)
+        return z
+    return _new_zn(n, bits, signed, w)
+
+def _unlimited_zn(n):
+    '''Return an unlimited Zn holding the int n.  There is nothing to
+    mask, so the arithmetic operators use this to make only the result
+    of an operation on two unlimited integers.
+    '''
+    if small_min <= n <= small_max:
+        return _small_unlimited[n - small_min] or make_zn(n, 0, True)
+    z = object.__new__(Zn)
+    z.n, z.num_bits, z.is_signed, z.width = n, 0, True, _unlimited
+    return z
+
 class Zn(object):
+    # Each value is normalized to its width when it is made, so a Zn is
+    # just these four fields.  width is the Width of num_bits.
+    __slots__ = ("n", "num_bits", "is_signed", "width")
+
     # These characters are used in the str representation of Zn objects
     # Example:  a 4-bit signed value of -2 is given as '-2<4s>'.
     left  = "<"
     right = ">"
     space = ""  # Put a space between the number and its designator
 
-    # These variables are private
-    num_bits = 0
-    is_signed = True
+    # The width and signedness of new values (the calculator's integer
+    # mode).  These variables are private.
+    mode_bits = 0
+    mode_signed = True
     use_C_division = False
-    base = 0
-    high_unsigned = 0
-    high_signed = 0
 
     # This variable is used to hold 0, 1, or 2.  These settings have
     # to do with the subtleties of negating 2's complement numbers.
@@ -608,31 +826,43 @@ class Zn(object):
     negate_zero = 0
 
     def __init__(self, value=0, proto=None):
-        self.n = 0
         if proto is not None:
-            self.num_bits = proto.num_bits
-            self.is_signed = proto.is_signed
+            bits, signed = proto.num_bits, proto.is_signed
         elif isinstance(value, Zn):
-            self.num_bits = value.num_bits
-            self.is_signed = value.is_signed
+            bits, signed = value.num_bits, value.is_signed
         else:
-            self.num_bits = Zn.num_bits
-            self.is_signed = Zn.is_signed
-        if self.num_bits > 0:
-            self.base = 2**self.num_bits
-        if type(value) == str:
-            self._set_from_string(value)
-        elif isinstance(value, int) or isinstance(value, long):
-            self.value = value
+            bits, signed = Zn.mode_bits, Zn.mode_signed
+        t = type(value)
+        if t is int or t is long:
+            n = value
         elif isinstance(value, Zn):
-            self.value = value.value
+            n = value.n
+        elif t is str:
+            n = self._from_string(value)
+        elif isinstance(value, (int, long)):
+            n = int(value)
         else:
             raise TypeError("%sCan't set integer from value '%s'" % \
                 (fln(), str(value)))
-        self._update()
+        self._set(n, bits, signed)
 
-    def _set_from_string(self, value):
-        '''We set our value from a string.  This can be either a
+    def _set(self, n, bits, signed):
+        '''Set the value n, masked to bits (if nonzero) and made negative
+        if signed and its high bit is set.
+        '''
+        w = _widths.get(bits) or width(bits)
+        if bits:
+            n &= w.mask
+            if signed and n & w.sign_bit:
+                n -= w.base
+        else:
+            signed = True
+        self.n, self.num_bits, self.is_signed, self.width = n, bits, signed, w
+        if debugging.debug_flag:
+            self._check()
+
+    def _from_string(self, value):
+        '''Return the integer in a string.  This can be either a
         regular string for an integer or long or a string gotten from
         our str() method.  In the second case, the value will be made
         to fit in the current representation, regardless of how many
@@ -640,18 +870,21 @@ class Zn(object):
         that the left character must match our current setting or an
         exception will be raised.
         '''
-        assert type(value) == type("")
         try:
             if Zn.left in value:
-                self.value = int(value.split(Zn.left)[0])
-            else:
-                self.value = int(value)
+                return int(value.split(Zn.left)[0])
+            return int(value)
         except:
             msg = "%sCan't set integer from '%s'"
             raise ValueError(msg % (fln(), value))
 
 
     # Properties
+    @property
+    def base(self):
+        "2**num_bits, or 0 for unlimited integers"
+        return self.width.base
+
     def get_C_division(self):
         return Zn.use_C_division
 
@@ -668,6 +901,7 @@ class Zn(object):
         return self.num_bits
 
     def set_bits(self, bits):
+        self._check_unshared()
         if not isinstance(bits, int) and \
            not isinstance(bits, long) and \
            not isinstance(bits, Zn):
@@ -677,13 +911,7 @@ class Zn(object):
             msg = "%sNumber of bits in integer must be >= 0"
             raise ValueError(msg % fln())
         if bits != self.num_bits:
-            self.num_bits = bits
-            self.num_bits = bits
-            if bits == 0:
-                self.base = 0 # Will cause 0 div if we use for % calc
-            else:
-                self.base = 2**bits
-            self._update()
+            self._set(self.n, int(bits), self.is_signed)
 
     bits = property(get_bits, set_bits, \
         doc="Number of bits in integer (0 for unlimited)")
@@ -692,25 +920,26 @@ class Zn(object):
         return self.is_signed
 
     def set_signed(self, signed):
+        self._check_unshared()
         if signed != True and signed != False:
             raise ValueError("%ssigned must be True or False" % fln())
-        self.is_signed = signed
-        self._update()
+        self._set(self.n, self.num_bits, signed)
 
     signed = property(get_signed, set_signed, doc="Signed if True")
 
     def set_value(self, value):
+        self._check_unshared()
         if isinstance(value, int) or isinstance(value, long):
-            self.n = value
+            n = value
         elif isinstance(value, Zn):
-            self.n = value.n
+            n = value.n
         else:
             try:
-                self.n = int(value)
+                n = int(value)
             except:
                 raise TypeError("%sCan't set integer from '%s'" % \
                     (fln(), str(value)))
-        self._update()
+        self._set(n, self.num_bits, self.is_signed)
 
     def get_value(self):
         return self.n
@@ -734,38 +963,39 @@ class Zn(object):
 
     def _update(self):
         "The object's state has changed."
-        if self.num_bits != 0:
-            assert self.base == 2**self.num_bits
-        if self.num_bits == 0:
-            self.is_signed = True
-        else:
-            if self.is_signed:
-                self.n &= (self.base - 1)  # Mask off the desired bits
-                # If high bit is on, then convert to negative in 2's
-                # complement
-                if self.n & 2**(self.num_bits - 1):
-                    self.n -= self.base
-            else:
-                self.n &= (self.base-1)
-        # Check our invariants
+        self._set(self.n, self.num_bits, self.is_signed)
+
+    def _check_unshared(self):
+        "Only a Zn made by Zn() may be changed, not a shared small value."
+        n = self.n
+        if small_min <= n <= small_max:
+            table = _interned.get(self.num_bits << 1 | self.is_signed)
+            if table is not None and table[n - small_min] is self:
+                raise ValueError("%sShared integers can't be changed" % fln())
+
+    def _check(self):
+        "Check our invariants (only done when debugging is on)."
+        w = self.width
+        assert w is width(self.num_bits)
         if self.num_bits == 0:
             assert self.is_signed == True
+        elif self.is_signed:
+            assert w.min <= self.n <= w.max
         else:
-            if self.is_signed:
-                assert -(self.base >> 1) <= self.n < (self.base >> 1)
-            else:
-                assert 0 <= self.n < self.base
+            assert 0 <= self.n <= w.mask
 
     def _auto_cast(self, y):
         '''y must be a Zn object for us to interoperate with.  We can
         convert regular integers.
         '''
         if isinstance(y, Zn):
-            p = Zn()
-            p.is_signed = y.is_signed and self.is_signed
-            p.num_bits = max(y.num_bits, self.num_bits)
-            y1 = Zn(y, proto=p)
-            x1 = Zn(self, proto=p)
+            bits = max(y.num_bits, self.num_bits)
+            signed = y.is_signed and self.is_signed
+            x1, y1 = self, y
+            if bits != x1.num_bits or signed != x1.is_signed:
+                x1 = make_zn(x1.n, bits, signed)
+            if bits != y1.num_bits or signed != y1.is_signed:
+                y1 = make_zn(y1.n, bits, signed)
             return y1, x1
         elif isinstance(y, mpf):
             return y, mpf(self.value)
@@ -781,54 +1011,42 @@ class Zn(object):
             return y, self.value
 
     def __hex__(self):
-        self._update()
         t = ""
         if self.num_bits != 0:
             t = self._suffix()
         sign = ""
-        num_hex_digits, r = divmod(self.num_bits, 4)
-        if r != 0: num_hex_digits += 1
         v = self.n
         if v < 0:
             sign = " "
             if self.is_signed and self.num_bits != 0:
-                v = self.n
-                v &= (self.base - 1)  # Mask off the desired bits
-                v |= (2**(self.bits - 1))
+                v &= self.width.mask    # Mask off the desired bits
         s = hex(v)[2:]
         if s[-1] == "L": s = s[:-1]     # Remove "L"
         if self.num_bits != 0:
-            while len(s) < num_hex_digits:
-                s = "0" + s
-        if self.num_bits != 0:  assert len(s) == num_hex_digits
+            s = s.zfill(self.width.hex_digits)
         return "%s0x%s%s" % (sign, s, t)
 
     def __oct__(self):
-        self._update()
         t = ""
         if self.num_bits != 0:
             t = self._suffix()
         sign = ""
-        num_oct_digits, r = divmod(self.num_bits, 3)
-        if r != 0: num_oct_digits += 1
         v = self.n
         if v < 0:
             sign = " "
             if self.is_signed and self.num_bits != 0:
-                v = self.n
-                v &= (self.base - 1)  # Mask off the desired bits
-                v |= (2**(self.bits - 1))
+                v &= self.width.mask    # Mask off the desired bits
         s = oct(v)[1:]
-        if s[0] == "o":  s = s[1:]  # Remove leading 'o' if present
+        if s[:1] == "o":  s = s[1:]  # Remove leading 'o' if present
+        if s[-1:] == "L": s = s[:-1]    # Remove "L"
         if self.num_bits != 0:
-            while len(s) < num_oct_digits:
-                s = "0" + s
-        if self.num_bits != 0:  assert len(s) == num_oct_digits
+            s = s.zfill(self.width.oct_digits)
+        elif not s:
+            s = "0"
         return "%s0o%s%s" % (sign, s, t)
 
     def bin(self):
         'Binary representation'
-        self._update()
         t = ""
         if self.num_bits != 0:
             t = self._suffix()
@@ -837,33 +1055,13 @@ class Zn(object):
         if v < 0:
             sign = " "
             if self.is_signed and self.num_bits != 0:
-                v = self.n
-                v &= (self.base - 1)  # Mask off the desired bits
-                v |= (2**(self.bits - 1))
+                v &= self.width.mask    # Mask off the desired bits
         s = bin(v)[2:]
-        while len(s) > 1 and s[0] == "0":  # Remove leading 0's
-            s = s[1:]
-        if s[-1] == "L": s = s[:-1]     # Remove "L"
-        if self.num_bits != 0:
-            while len(s) > self.num_bits:  # Trim leading 0's to get num bits
-                assert s[0] == "0", "s = '%s'" % s
-                s = s[1:]
-        if self.num_bits == 0:
-            while len(s) > 1 and s[0] == "0":  # Remove leading 0's
-                s = s[1:]
-        else:
-            if len(s) > self.num_bits:
-                s = s[len(s) - self.num_bits:]
-            else:
-                # Add leading zeros if length is not == num bits
-                while len(s) < self.num_bits:
-                    s = "0" + s
         if self.num_bits != 0:
-            assert len(s) == self.num_bits, "s='%s'  %d bits" % (s, self.num_bits)
+            s = s.zfill(self.num_bits)
         return "%s0b%s%s" % (sign, s, t)
 
     def roman(self):
-        self._update()
         sign = " "
         v = self.n
         if v < 0:
@@ -933,7 +1131,6 @@ class Zn(object):
             return fmt % ("u", self.num_bits)
 
     def __str__(self):
-        self._update()
         if self.num_bits == 0:
             s = str(self.value)
         else:
@@ -964,9 +1161,10 @@ class Zn(object):
     def __abs__(self):
         'See comments under __neg__ for some subleties.'
         msg = "%sCan't take the absolute value of the most negative number"
-        if self.is_signed == True and self.n == -(self.base >> 1):
+        if self.is_signed == True and self.num_bits and \
+           self.n == self.width.min:
             raise ValueError(msg % fln())
-        return Zn(abs(self.n))
+        return make_zn(abs(self.n))
 
     def __neg__(self):
         '''Dealing with the subtleties of 2's complement arithmetic.
@@ -1033,8 +1231,8 @@ class Zn(object):
         an unsigned values and see what happened.
         '''
         if self.n == 0 and Zn.negate_zero and self.is_signed:
-            return Zn(-(self.base >> 1))
-        return Zn(-self.n)
+            return make_zn(self.width.min)
+        return make_zn(-self.n)
 
     def __coerce__(self, other):
         # hmmmmm.... the types we can encounter
@@ -1052,103 +1250,67 @@ class Zn(object):
         return None
 
     def __add__(self, y):
+        if type(y) is Zn and not (self.num_bits or y.num_bits):
+            return _unlimited_zn(self.n + y.n)
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(x1.value + y1.value, proto=x1)
+            return make_zn(x1.value + y1.value, x1.num_bits, x1.is_signed)
         return x1 + y1
 
-    def __iadd__(self, y):
-        y1, x1 = self._auto_cast(y)
-        if isinstance(y1, Zn) and isinstance(x1, Zn):
-            self.value += z.value
-            self.is_signed = x1.is_signed
-            self.bits = x1.num_bits
-            return self
-        return y1 + x1
-
     def __radd__(self, y):
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(y1.value + x1.value, proto=x1)
+            return make_zn(y1.value + x1.value, x1.num_bits, x1.is_signed)
         return y1 + x1
 
     def __sub__(self, y):
+        if type(y) is Zn and not (self.num_bits or y.num_bits):
+            return _unlimited_zn(self.n - y.n)
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(x1.value - y1.value, proto=x1)
+            return make_zn(x1.value - y1.value, x1.num_bits, x1.is_signed)
         return x1 - y1
 
-    def __isub__(self, y):
-        y1, x1 = self._auto_cast(y)
-        if isinstance(y1, Zn) and isinstance(x1, Zn):
-            self.value -= z.value
-            self.is_signed = x1.is_signed
-            self.bits = x1.num_bits
-            return self
-        return y1 - x1
-
     def __rsub__(self, y):
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(y1.value - x1.value, proto=x1)
+            return make_zn(y1.value - x1.value, x1.num_bits, x1.is_signed)
         return y1 - x1
 
     def __mul__(self, y):
+        if type(y) is Zn and not (self.num_bits or y.num_bits):
+            return _unlimited_zn(bigint.mul(self.n, y.n))
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(x1.value * y1.value, proto=x1)
+            return make_zn(x1.value * y1.value, x1.num_bits, x1.is_signed)
         return x1 * y1
 
-    def __imul__(self, y):
-        y1, x1 = self._auto_cast(y)
-        if isinstance(y1, Zn) and isinstance(x1, Zn):
-            self.value *= z.value
-            self.is_signed = x1.is_signed
-            self.bits = x1.num_bits
-            return self
-        return y1 * x1
-
     def __rmul__(self, y):
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(x1.value * y1.value, proto=x1)
+            return make_zn(x1.value * y1.value, x1.num_bits, x1.is_signed)
         return x1 * y1
 
     def __div__(self, y):
         #print "__div__(%d, %d)"%(self.value, y.value)
+        if type(y) is Zn and not (self.num_bits or y.num_bits or
+                                  Zn.use_C_division):
+            return _unlimited_zn(bigint.floordiv(self.n, y.n))
         y1, x1 = self._auto_cast(y)
+        bits, signed = x1.num_bits, x1.is_signed
         if Zn.use_C_division:
             if x1.is_signed == True:
                 sign = x1._sgn(x1.n)*x1._sgn(y1.n)
                 if x1.num_bits != 0:
-                    assert -(x1.base >> 1) <= x1.n < (x1.base >> 1)
-                    assert -(x1.base >> 1) <= y1.n    < (x1.base >> 1)
-                    m = x1.base >> 1
-                    return Zn(sign*((abs(x1.value) % m)//(abs(y1.value) % m)), proto=x1)
+                    m = x1.width.sign_bit
+                    q = (abs(x1.value) % m)//(abs(y1.value) % m)
                 else:
-                    return Zn(sign*(abs(x1.value)//abs(y1.value)), proto=x1)
+                    q = abs(x1.value)//abs(y1.value)
+                return make_zn(sign*q, bits, signed)
             else:
-                if x1.num_bits != 0:
-                    assert 0 <= x1.n < x1.base
-                    assert 0 <= y1.n    < x1.base
-                return Zn(x1.n//y1.n, proto=x1)
-        else:
-            return Zn(x1.value//y1.value, proto=x1)
-
-    def __idiv__(self, y):
-        y1, x1 = self._auto_cast(y)
-        if not isinstance(y1, Zn) or not isinstance(x1, Zn):
-            raise TypeError("Invalid types to integer __idiv__")
-        if Zn.use_C_division:
-            sign_x = x1._sgn(x1.value)
-            sign_y = x1._sgn(y1.value)
-            x1.value = sign_x*sign_y*(abs(x1.value)//abs(y1.value))
+                return make_zn(x1.n//y1.n, bits, signed)
         else:
-            x1.value //= y1.value
-        self.is_signed = x1.is_signed
-        self.num_bits = x1.num_bits
-        self.value = x1.value
-        return self
+            return make_zn(x1.value//y1.value, bits, signed)
 
     def __rdiv__(self, y):
         y1, x1 = self._auto_cast(y)
@@ -1157,24 +1319,16 @@ class Zn(object):
         return y1 / x1
 
     __floordiv__ = __div__
-    __ifloordiv__ = __idiv__
     __rfloordiv__ = __rdiv__
 
     def __mod__(self, y):
+        if type(y) is Zn and not (self.num_bits or y.num_bits):
+            return _unlimited_zn(bigint.mod(self.n, y.n))
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(x1.value % y1.value, proto=x1)
+            return make_zn(x1.value % y1.value, x1.num_bits, x1.is_signed)
         return x1 % y1
 
-    def __imod__(self, y):
-        y1, x1 = self._auto_cast(y)
-        if isinstance(y1, Zn) and isinstance(x1, Zn):
-            self.value %= z.value
-            self.is_signed = x1.is_signed
-            self.bits = x1.num_bits
-            return self
-        return y1 % x1
-
     def __rmod__(self, y):
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
@@ -1194,87 +1348,61 @@ class Zn(object):
             if mpf(self.value) < y:  return -1
             if mpf(self.value) == y: return 0
             else:                    return 1
+        elif isinstance(y, (Rational, Fixed)):
+            return -y.__cmp__(self)
         else:
             return -1
 
     def __and__(self, y):
+        if type(y) is Zn and not (self.num_bits or y.num_bits):
+            return _unlimited_zn(self.n & y.n)
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(x1.value & y1.value, proto=x1)
+            return make_zn(x1.value & y1.value, x1.num_bits, x1.is_signed)
         return x1 & y1
 
-    def __iand__(self, y):
-        y1, x1 = self._auto_cast(y)
-        if isinstance(y1, Zn) and isinstance(x1, Zn):
-            self.value &= z.value
-            self.is_signed = x1.is_signed
-            self.bits = x1.num_bits
-            return self
-        return y1 & x1
-
     def __rand__(self, y):
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(y1.value & x1.value, proto=x1)
+            return make_zn(y1.value & x1.value, x1.num_bits, x1.is_signed)
         return y1 & x1
 
     def __or__(self, y):
+        if type(y) is Zn and not (self.num_bits or y.num_bits):
+            return _unlimited_zn(self.n | y.n)
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(x1.value | y1.value, proto=x1)
+            return make_zn(x1.value | y1.value, x1.num_bits, x1.is_signed)
         return x1 | y1
 
-    def __ior__(self, y):
-        y1, x1 = self._auto_cast(y)
-        if isinstance(y1, Zn) and isinstance(x1, Zn):
-            self.value |= z.value
-            self.is_signed = x1.is_signed
-            self.bits = x1.num_bits
-            return self
-        return y1 | x1
-
     def __ror__(self, y):
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(y1.value | x1.value, proto=x1)
+            return make_zn(y1.value | x1.value, x1.num_bits, x1.is_signed)
         return y1 | x1
 
     def __xor__(self, y):
+        if type(y) is Zn and not (self.num_bits or y.num_bits):
+            return _unlimited_zn(self.n ^ y.n)
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(x1.value ^ y1.value, proto=x1)
+            return make_zn(x1.value ^ y1.value, x1.num_bits, x1.is_signed)
         return x1 ^ y1
 
-    def __ixor__(self, y):
-        y1, x1 = self._auto_cast(y)
-        if isinstance(y1, Zn) and isinstance(x1, Zn):
-            self.value ^= z.value
-            self.is_signed = x1.is_signed
-            self.bits = x1.num_bits
-            return self
-        return y1 ^ x1
-
     def __rxor__(self, y):
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(y1.value ^ x1.value, proto=x1)
+            return make_zn(y1.value ^ x1.value, x1.num_bits, x1.is_signed)
         return y1 ^ x1
 
     def __lshift__(self, y):
+        if type(y) is Zn and not (self.num_bits or y.num_bits):
+            return _unlimited_zn(self.n << y.n)
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(x1.value << y1.value, proto=x1)
+            return make_zn(x1.value << y1.value, x1.num_bits, x1.is_signed)
         return x1 << y1
 
-    def __ilshift__(self, y):
-        y1, x1 = self._auto_cast(y)
-        if isinstance(y1, Zn) and isinstance(x1, Zn):
-            self.value <<= z.value
-            self.is_signed = x1.is_signed
-            self.bits = x1.num_bits
-            return self
-        return y1 << x1
-
     def __rlshift__(self, y):
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
@@ -1282,20 +1410,13 @@ class Zn(object):
         return y1 << x1
 
     def __rshift__(self, y):
+        if type(y) is Zn and not (self.num_bits or y.num_bits):
+            return _unlimited_zn(self.n >> y.n)
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(x1.value >> y1.value, proto=x1)
+            return make_zn(x1.value >> y1.value, x1.num_bits, x1.is_signed)
         return x1 >> y1
 
-    def __irshift__(self, y):
-        y1, x1 = self._auto_cast(y)
-        if isinstance(y1, Zn) and isinstance(x1, Zn):
-            self.value >>= z.value
-            self.is_signed = x1.is_signed
-            self.bits = x1.num_bits
-            return self
-        return y1 >> x1
-
     def __rrshift__(self, y):
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
@@ -1303,16 +1424,18 @@ class Zn(object):
         return y1 >> x1
 
     def __invert__(self):
-        return Zn(~self.value)
+        return make_zn(~self.n)
 
     def __truediv__(self, y):
         if isinstance(y, Zn): y = mpf(y.value)
         return self.value / y
 
     def __pow__(self, y):
+        if type(y) is Zn and y.n >= 0 and not (self.num_bits or y.num_bits):
+            return _unlimited_zn(bigint.power(self.n, y.n))
         y1, x1 = self._auto_cast(y)
         if isinstance(y1, Zn) and isinstance(x1, Zn):
-            return Zn(x1.value ** y1.value, proto=x1)
+            return make_zn(x1.value ** y1.value, x1.num_bits, x1.is_signed)
         return x1 ** y1
 
 class ipaddr(Zn):
@@ -1480,21 +1603,21 @@ if __name__ == "__main__":
             assert u & v == Zn(x & y)
             assert u | v == Zn(x | y)
             assert u ^ v == Zn(x ^ y)
-            assert u << v == (Zn((x << y) % (Zn.high_unsigned - 1)))
+            assert u << v == (Zn((x << y) % (width(4).base - 1)))
             assert u >> v == Zn(x >> y)
             if y: assert u % v == Zn(x % y)
             assert ~u == Zn(~x)
             w = Zn(u.value); w &= v;  assert w == Zn(x & y)
             w = Zn(u.value); w |= v;  assert w == Zn(x | y)
             w = Zn(u.value); w ^= v;  assert w == Zn(x ^ y)
-            w = Zn(u.value); w <<= v; assert w == Zn((x << y) % (Zn.high_unsigned - 1))
+            w = Zn(u.value); w <<= v; assert w == Zn((x << y) % (width(4).base - 1))
             w = Zn(u.value); w >>= v; assert w == Zn(x >> y)
-        n = Zn.high_unsigned
+        n = width(4).base
         for i in xrange(n):
             for j in xrange(n):
                 twiddle(i, j, True)
                 twiddle(i, j, False)
-        n = Zn.high_signed
+        n = width(4).sign_bit
         for i in xrange(-n, n):
             for j in xrange(-n, n):
                 twiddle(i, j, True)
@@ -1600,6 +1723,388 @@ if __name__ == "__main__":
     TestChangingNumberOfBits()
     exit(0)
 '''
+Q format fixed point numbers.
+
+A signed Qm.n number has a sign bit, m integer bits and n fraction bits
+(m + n + 1 bits in all); an unsigned UQm.n number has m + n bits.  The
+value is kept as the integer raw, which stands for raw/2**n, so the
+arithmetic is integer arithmetic plus a shift.  Results that need
+rounding are rounded by Fixed.rounding:
+
+    truncate    Drop the low bits (round toward -infinity), as the
+                hardware does
+    nearest     Round half up (add half an LSB, then truncate)
+    convergent  Round half to even
+
+and results that don't fit are handled by Fixed.overflow:
+
+    wrap        Keep the low bits, like a two's complement register
+    saturate    Clamp to the largest or smallest value
+'''
+
+class QFormat(object):
+    '''The constants for a Q format, worked out once per format; use
+    qformat() to get them.
+    '''
+    __slots__ = ("int_bits", "frac_bits", "signed", "width", "min", "max")
+    def __init__(self, int_bits, frac_bits, signed):
+        self.int_bits, self.frac_bits, self.signed = \
+            int_bits, frac_bits, signed
+        self.width = width(int_bits + frac_bits + signed)
+        if signed:
+            self.min, self.max = self.width.min, self.width.max
+        else:
+            self.min, self.max = 0, self.width.mask
+
+    def __reduce__(self):
+        # Unpickle to the shared object
+        return (qformat, (self.int_bits, self.frac_bits, self.signed))
+
+    def __str__(self):
+        if self.signed:
+            return "q%d.%d" % (self.int_bits, self.frac_bits)
+        return "uq%d.%d" % (self.int_bits, self.frac_bits)
+
+_qformats = {}
+
+def qformat(int_bits, frac_bits, signed=True):
+    '''Return the QFormat with the given numbers of integer and fraction
+    bits.
+    '''
+    key = (int_bits, frac_bits, bool(signed))
+    try:
+        return _qformats[key]
+    except KeyError:
+        if int_bits < 0 or frac_bits < 0 or int_bits + frac_bits + signed < 1:
+            raise ValueError("%sQ%d.%d is not a valid format" %
+                             (fln(), int_bits, frac_bits))
+        f = _qformats[key] = QFormat(*key)
+        return f
+
+def _fit(r, f):
+    '''Return the raw value r made to fit the format f.'''
+    if f.min <= r <= f.max:
+        return r
+    if Fixed.overflow == "saturate":
+        if r < f.min:
+            return f.min
+        return f.max
+    w = f.width
+    r &= w.mask
+    if f.signed and r & w.sign_bit:
+        r -= w.base
+    return r
+
+def _round_div(num, den):
+    '''Return num/den (den > 0) rounded to an integer.'''
+    q, r = divmod(num, den)
+    if r and Fixed.rounding != "truncate":
+        r += r
+        if r > den or (r == den and (Fixed.rounding == "nearest" or q & 1)):
+            q += 1
+    return q
+
+def _round_shift(r, shift):
+    '''Return r/2**shift rounded to an integer.'''
+    if shift <= 0:
+        return r << -shift
+    q = r >> shift
+    if Fixed.rounding != "truncate":
+        half = 1 << (shift - 1)
+        low = r & (half + half - 1)
+        if low > half or \
+           (low == half and (Fixed.rounding == "nearest" or q & 1)):
+            q += 1
+    return q
+
+def _new_fixed(raw, f):
+    # Make a Fixed from a raw value that fits f without going through
+    # __init__
+    x = object.__new__(Fixed)
+    x.raw, x.format = raw, f
+    return x
+
+class Fixed(object):
+    '''A Q format fixed point number:  raw/2**n in the QFormat format.
+    Arithmetic with another Fixed or an integer gives a Fixed; with a
+    Rational it gives a Rational and with the other reals an mpf.
+    '''
+    __slots__ = ("raw", "format")
+
+    # The format of new values, and how results are rounded and made to
+    # fit.  These are set by the calculator's fixed point mode.
+    mode = None     # Set to Q0.15 below
+    rounding = "nearest"    # truncate, nearest or convergent
+    overflow = "saturate"   # wrap or saturate
+    roundings = ("truncate", "nearest", "convergent")
+    overflows = ("wrap", "saturate")
+
+    def __init__(self, value=0, fmt=None):
+        '''value is an integer, Rational, mpf or Fixed; it is rounded to
+        the format fmt (by default the fixed point mode).
+        '''
+        if fmt is None:
+            fmt = Fixed.mode
+        n = fmt.frac_bits
+        if isinstance(value, Fixed):
+            r = _round_shift(value.raw, value.format.frac_bits - n)
+        elif isint(value):
+            r = int(value) << n
+        elif isinstance(value, Rational):
+            r = _round_div(value._n << n, value._d)
+        elif isinstance(value, mpf):
+            p, q = _mpf_ratio(value)
+            r = _round_div(p << n, q)
+        else:
+            raise TypeError("%sCan't make a fixed point number from '%s'" %
+                            (fln(), str(value)))
+        self.raw, self.format = _fit(r, fmt), fmt
+
+    def _common(self, y):
+        '''Return the raw values of self and the Fixed or integer y in a
+        common format, and the format; or None if y is some other type.
+        The common format of two Fixed has the larger of their integer
+        and fraction bits and is signed if both are (as for Zn).
+        '''
+        f = self.format
+        if isinstance(y, Fixed):
+            g = y.format
+            if g is f:
+                return self.raw, y.raw, f
+            f = qformat(max(f.int_bits, g.int_bits),
+                        max(f.frac_bits, g.frac_bits), f.signed and g.signed)
+            return (self.raw << f.frac_bits - self.format.frac_bits,
+                    y.raw << f.frac_bits - g.frac_bits, f)
+        elif isint(y):
+            return self.raw, int(y) << f.frac_bits, f
+        return None
+
+    def _promote(self, y):
+        'Return self as the type it is combined with y in.'
+        if isinstance(y, Rational):
+            return self.rational()
+        return self.mpf()
+
+    def __add__(self, y):
+        if type(y) is Fixed and y.format is self.format:
+            return _new_fixed(_fit(self.raw + y.raw, self.format), self.format)
+        c = self._common(y)
+        if c is None:
+            return self._promote(y) + y
+        a, b, f = c
+        return _new_fixed(_fit(a + b, f), f)
+
+    __radd__ = __add__
+
+    def __sub__(self, y):
+        if type(y) is Fixed and y.format is self.format:
+            return _new_fixed(_fit(self.raw - y.raw, self.format), self.format)
+        c = self._common(y)
+        if c is None:
+            return self._promote(y) - y
+        a, b, f = c
+        return _new_fixed(_fit(a - b, f), f)
+
+    def __rsub__(self, y):
+        c = self._common(y)
+        if c is None:
+            return y - self._promote(y)
+        a, b, f = c
+        return _new_fixed(_fit(b - a, f), f)
+
+    def __mul__(self, y):
+        c = self._common(y)
+        if c is None:
+            return self._promote(y)*y
+        a, b, f = c
+        return _new_fixed(_fit(_round_shift(a*b, f.frac_bits), f), f)
+
+    __rmul__ = __mul__
+
+    def _divide(self, a, b, f):
+        if not b:
+            raise ZeroDivisionError("Divisor is zero")
+        a <<= f.frac_bits
+        if b < 0:
+            a, b = -a, -b
+        return _new_fixed(_fit(_round_div(a, b), f), f)
+
+    def __div__(self, y):
+        c = self._common(y)
+        if c is None:
+            return self._promote(y)/y
+        return self._divide(*c)
+
+    def __rdiv__(self, y):
+        c = self._common(y)
+        if c is None:
+            return y/self._promote(y)
+        a, b, f = c
+        return self._divide(b, a, f)
+
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+
+    def __pow__(self, y):
+        '''Only to non-negative integer powers; each multiplication is
+        rounded, as a sequence of multiplies would be.
+        '''
+        if not isint(y) or y < 0:
+            return self.mpf()**y
+        y = int(y)
+        f = self.format
+        result, x = None, self
+        while y:
+            if y & 1:
+                if result is None:
+                    result = x
+                else:
+                    result = result*x
+            y >>= 1
+            if y:
+                x = x*x
+        if result is None:
+            return _new_fixed(_fit(1 << f.frac_bits, f), f)
+        return result
+
+    def __lshift__(self, y):
+        return _new_fixed(_fit(self.raw << int(y), self.format), self.format)
+
+    def __rshift__(self, y):
+        return _new_fixed(_round_shift(self.raw, int(y)), self.format)
+
+    def __neg__(self):
+        return _new_fixed(_fit(-self.raw, self.format), self.format)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        return _new_fixed(_fit(abs(self.raw), self.format), self.format)
+
+    def __nonzero__(self):
+        return self.raw != 0
+
+    def __cmp__(self, y):
+        '''Compares exactly with Fixed, integer, Rational, mpf and float
+        values.
+        '''
+        if y is None:
+            return -1
+        c = self._common(y)
+        if c is not None:
+            return cmp(c[0], c[1])
+        elif isinstance(y, (Rational, mpf, float)):
+            return self.rational().__cmp__(y)
+        raise ValueError("%sCan't compare fixed point and %s" %
+                         (fln(), type(y).__name__))
+
+    def __eq__(self, y): return self.__cmp__(y) == 0
+    def __ne__(self, y): return self.__cmp__(y) != 0
+    def __lt__(self, y): return self.__cmp__(y) < 0
+    def __le__(self, y): return self.__cmp__(y) <= 0
+    def __gt__(self, y): return self.__cmp__(y) > 0
+    def __ge__(self, y): return self.__cmp__(y) >= 0
+
+    def __hash__(self):
+        return hash(self.rational())
+
+    def rational(self):
+        'The exact value as a Rational'
+        return _rational(self.raw, 1 << self.format.frac_bits)
+
+    @property
+    def _mpf_(self):
+        '''The exact value as an mpf tuple, so that mpmath functions take a
+        Fixed as an mpf.
+        '''
+        return from_man_exp(self.raw, -self.format.frac_bits)
+
+    def mpf(self):
+        return mpf(self._mpf_)
+
+    def __int__(self):
+        # Toward zero, like int() of a float
+        n = self.format.frac_bits
+        if self.raw < 0:
+            return -(-self.raw >> n)
+        return self.raw >> n
+
+    __long__ = __int__
+
+    def __float__(self):
+        return ldexp(self.raw, -self.format.frac_bits)
+
+    def _suffix(self):
+        return Zn.space + Zn.left + str(self.format) + Zn.right
+
+    def _bits(self):
+        # The raw value as an unsigned register
+        return self.raw & self.format.width.mask
+
+    def decimal(self):
+        '''The exact decimal value:  n fraction bits need at most n
+        decimal places.
+        '''
+        n = self.format.frac_bits
+        sign, r = "", self.raw
+        if r < 0:
+            sign, r = "-", -r
+        whole, frac = r >> n, r & ((1 << n) - 1)
+        s = "%s%d" % (sign, whole)
+        if n:
+            digits = str(frac*5**n).zfill(n).rstrip("0") or "0"
+            s += "." + digits
+        return s
+
+    def __str__(self):
+        return self.decimal() + self._suffix()
+
+    def __repr__(self):
+        return "Fixed(%s, qformat(%d, %d, %s))" % (self.decimal(),
+            self.format.int_bits, self.format.frac_bits, self.format.signed)
+
+    def __hex__(self):
+        s = "%x" % self._bits()
+        return "0x%s%s" % (s.zfill(self.format.width.hex_digits), self._suffix())
+
+    def __oct__(self):
+        s = "%o" % self._bits()
+        return "0o%s%s" % (s.zfill(self.format.width.oct_digits), self._suffix())
+
+    def bin(self):
+        'Binary representation'
+        s = bin(self._bits())[2:]
+        return "0b%s%s" % (s.zfill(self.format.width.bits), self._suffix())
+
+Fixed.mode = qformat(0, 15)
+
+# A Fixed as written by exact_str or shown by str(), e.g. "0.5<q0.15>",
+# or its raw bits as shown in hex, octal or binary, e.g. "0x4000<q0.15>".
+fixed_literal = re.compile(r"^(\S+?)\s*<(u?)q(\d+)\.(\d+)>$")
+
+def parse_fixed(s):
+    '''Return the Fixed in the string s, or None if s isn't one.'''
+    m = fixed_literal.match(s)
+    if m is None:
+        return None
+    value, unsigned, int_bits, frac_bits = m.groups()
+    f = qformat(int(int_bits), int(frac_bits), not unsigned)
+    try:
+        if value[:2] in ("0x", "0o", "0b"):
+            r = int(value[2:], {"x": 16, "o": 8, "b": 2}[value[1]])
+            w = f.width
+            if r > w.mask:
+                return None     # Too many bits for the format
+            if f.signed and r & w.sign_bit:
+                r -= w.base
+            return _new_fixed(r, f)
+        v = Fraction(value)
+    except ValueError:
+        return None
+    return Fixed(Rational(v.numerator, v.denominator), f)
+
+'''
 $Id: julian.py 1.15 2009/02/11 02:39:22 donp Exp $
 
 Provides a Julian object which behaves as either an mpf or mpi number.
@@ -2328,7 +2833,8 @@ class Number(object):
                     else:
                         suffix = mpf("1e" + str(exponent))
                     s = s[:-1]
-        for func in (self.ip, self.j, self.i, self.q, self.v, self.r, self.c):
+        for func in (self.ip, self.j, self.x, self.i, self.q, self.v, self.r,
+                     self.c):
             x = func(s)
             if x != None:
                 if suffix == 1:
@@ -2362,6 +2868,12 @@ class Number(object):
                 return Julian(s)
         return None
 
+    def x(self, s):
+        # A fixed point number such as 0.5<q0.15>
+        if s[-1:] == ">":
+            return parse_fixed(s)
+        return None
+
     def i(self, s):
         # Handle special cases like 0x, 0o, and 0b
         try:
@@ -2378,9 +2890,9 @@ class Number(object):
                     value = int(s[2:], 2)
                     match = True
             if integer.match(s):
-                return Zn(int(s))
+                return make_zn(int(s))
             if match:
-                return Zn(value)
+                return make_zn(value)
         except ValueError:
             pass
         except Exception:
@@ -2724,6 +3236,120 @@ MPF = "r"
 MPC = "c"
 MPI = "i"
 JUL = "t"
+FIX = "x"
+
+def _mpf_str(v):
+    # Enough digits to give back the same mantissa
+    return to_str(v, repr_dps(max(mp.prec, v[3])))
+
+def exact_str(x):
+    '''Return a string that Number() reads back as the same value as x,
+    e.g. "-12", "1/3", "0.33333333333333331", "(1.0,2.0)", "[1.0,2.0]"
+    or "0.5<q0.15>".
+    '''
+    if isinstance(x, Fixed):
+        return "%s<%s>" % (x.decimal(), x.format)
+    elif isint(x):
+        return str(int(x))
+    elif isinstance(x, Rational):
+        return "%d/%d" % (x.n, x.d)
+    elif isinstance(x, mpf):
+        return _mpf_str(x._mpf_)
+    elif isinstance(x, mpc):
+        re, im = x._mpc_
+        return "(%s,%s)" % (_mpf_str(re), _mpf_str(im))
+    elif isinstance(x, ctx_iv.ivmpf):
+        a, b = x._mpi_
+        return "[%s,%s]" % (_mpf_str(a), _mpf_str(b))
+    return str(x)
+
+def exact_value(x):
+    '''Return the value of a real number x as an int or a Fraction, which
+    compare and hash consistently with each other whatever type x was.
+    '''
+    if isint(x):
+        return int(x)
+    elif isinstance(x, Rational):
+        return Fraction(x.n, x.d)
+    elif isinstance(x, Fraction):
+        return x
+    elif isinstance(x, Fixed):
+        return Fraction(x.raw, 1 << x.format.frac_bits)
+    elif isinstance(x, Julian):
+        return exact_value(x.to_mpf())
+    elif isinstance(x, mpf):
+        sign, man, exp, bc = x._mpf_
+        if not man:
+            if x:
+                raise ValueError("%sCan't order %s" % (fln(), x))
+            return 0
+        man = int(man)      # An mpz when mpmath is using gmpy
+        if sign:
+            man = -man
+        if exp >= 0:
+            return man << exp
+        return Fraction(man, 1 << -exp)
+    raise ValueError("%sCan't order %s numbers" % (fln(), type(x).__name__))
+
+class _Exact(object):
+    '''Compares as exact_value(x), which is only worked out when two
+    sort_keys have the same float.
+    '''
+    __slots__ = ("x", "v")
+    def __init__(self, x):
+        self.x = x
+    def value(self):
+        try:
+            return self.v
+        except AttributeError:
+            self.v = exact_value(self.x)
+            return self.v
+    def __eq__(self, other):
+        return self.value() == _exact(other)
+    def __ne__(self, other):
+        return self.value() != _exact(other)
+    def __lt__(self, other):
+        return self.value() < _exact(other)
+    def __gt__(self, other):
+        return self.value() > _exact(other)
+
+def _exact(x):
+    if isinstance(x, _Exact):
+        return x.value()
+    return x
+
+def sort_key(x):
+    '''A key for sorting mixed integers, rationals and reals exactly.  The
+    correctly rounded float comes first, so it is never out of order with
+    the exact value and most comparisons are between two floats; only
+    ties go on to compare exact values.
+    '''
+    try:
+        # Every float here is rounded to nearest, whatever mp's rounding is
+        if isinstance(x, mpf):
+            if x._mpf_[1]:
+                return (to_float(x._mpf_, False, round_nearest), _Exact(x))
+        elif isint(x):
+            v = int(x)
+            return (float(v), v)
+        elif isinstance(x, Rational):
+            return (truediv(x.n, x.d), _Exact(x))
+        elif isinstance(x, Fraction):
+            return (truediv(x.numerator, x.denominator), x)
+        v = exact_value(x)
+        return (float(v), v)
+    except OverflowError:
+        if x < 0:
+            return (float("-inf"), _Exact(x))
+        return (float("inf"), _Exact(x))
+
+def key_value(key):
+    '''Return the exact value (an int or Fraction) of a sort_key.'''
+    return _exact(key[1])
+
+def _iv_mid(x):
+    '''The midpoint of the interval x as an mpf (x.mid is an interval).'''
+    return mpf(x.mid._mpi_[0])
 
 def Convert(x, arg_type, digits=0):
     '''Converts amongst the numerical types.  Some conversions lose
@@ -2736,24 +3362,27 @@ def Convert(x, arg_type, digits=0):
         elif isinstance(x, Rational): return Zn(int(mpf(x.n)/mpf(x.d)))
         elif isinstance(x, mpf):      return Zn(int(x))
         elif isinstance(x, mpc):      return Zn(int(abs(x)))
-        elif isinstance(x, ctx_iv.ivmpf):      return Zn(int(x.mid))
+        elif isinstance(x, ctx_iv.ivmpf):      return Zn(int(_iv_mid(x)))
         elif isinstance(x, Julian):   return Zn(int(x))
+        elif isinstance(x, Fixed):    return Zn(int(x))
         else: raise e
     elif arg_type == RAT:
         if isint(x):                  return Rational(int(x), 1)
         elif isinstance(x, Rational): return x
         elif isinstance(x, mpf):      return Rational().frac(x, digits)
         elif isinstance(x, mpc):      return Rational().frac(abs(x), digits)
-        elif isinstance(x, ctx_iv.ivmpf):      return Rational(x.mid)
+        elif isinstance(x, ctx_iv.ivmpf):      return Rational(_iv_mid(x))
         elif isinstance(x, Julian):   return Rational().frac(x.to_mpf(), digits)
+        elif isinstance(x, Fixed):    return x.rational()
         else: raise e
     elif arg_type == MPF:
         if isint(x):                  return mpf(int(x))
         elif isinstance(x, Rational): return x.mpf()
         elif isinstance(x, mpf):      return x
         elif isinstance(x, mpc):      return abs(x)
-        elif isinstance(x, ctx_iv.ivmpf):      return x.mid
+        elif isinstance(x, ctx_iv.ivmpf):      return _iv_mid(x)
         elif isinstance(x, Julian):   return x.to_mpf()
+        elif isinstance(x, Fixed):    return x.mpf()
         else: raise e
     elif arg_type == MPC:
         if isint(x):                  return mpc(int(x))
@@ -2762,6 +3391,7 @@ def Convert(x, arg_type, digits=0):
         elif isinstance(x, mpc):      return x
         elif isinstance(x, ctx_iv.ivmpf):      return mpc(x.mid, 0)
         elif isinstance(x, Julian):   return mpc(x.to_mpf(), 0)
+        elif isinstance(x, Fixed):    return mpc(x.mpf(), 0)
         else: raise e
     elif arg_type == MPI:
         if isint(x):                  return mpi(int(x))
@@ -2772,6 +3402,7 @@ def Convert(x, arg_type, digits=0):
         elif isinstance(x, Julian):
             if isinstance(x.value, mpf):  return mpi(x.value)
             else:                         return x.value
+        elif isinstance(x, Fixed):    return mpi(x.mpf())
         else: raise e
     elif arg_type == JUL:
         if isint(x):                  return Julian(int(x))
@@ -2780,6 +3411,16 @@ def Convert(x, arg_type, digits=0):
         elif isinstance(x, mpc):      return Julian(abs(x))
         elif isinstance(x, ctx_iv.ivmpf):      return Julian(x)
         elif isinstance(x, Julian):   return x
+        elif isinstance(x, Fixed):    return Julian(x.mpf())
+        else: raise e
+    elif arg_type == FIX:
+        if isinstance(x, Fixed):      return x
+        elif isint(x):                return Fixed(x)
+        elif isinstance(x, Rational): return Fixed(x)
+        elif isinstance(x, mpf):      return Fixed(x)
+        elif isinstance(x, mpc):      return Fixed(abs(x))
+        elif isinstance(x, ctx_iv.ivmpf):      return Fixed(_iv_mid(x))
+        elif isinstance(x, Julian):   return Fixed(x.to_mpf())
         else: raise e
     else:
         raise SyntaxError("Unknown type")
@@ -2795,14 +3436,16 @@ if __name__ == "__main__":
             mpc(n, n),
             mpi(n),
             Julian(n),
+            Fixed(n),
         )
         results = (
             (INT, Zn),
             (RAT, Rational),
             (MPF, mpf),
             (MPC, mpc),
-            (MPI, mpi),
-            (JUL, Julian)
+            (MPI, ctx_iv.ivmpf),
+            (JUL, Julian),
+            (FIX, Fixed)
         )
         for number in number_types:
             for typename, type in results:
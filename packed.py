@@ -0,0 +1,324 @@
+'''
+Compact in-memory storage for the bottom of a deep stack:  runs of
+fixed-width integers and of reals are kept in typed arrays rather than as
+one Python object per entry.
+
+---------------------------------------------------------------------------
+Copyright (c) 2011, Vernon Mauery
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or
+without modification, are permitted provided that the following
+conditions are met:
+
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following
+disclaimer in the documentation and/or other materials provided
+with the distribution.
+* The names of the contributors may not be used to endorse or
+promote products derived from this software without specific
+prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+from array import array
+from bisect import bisect_right
+from mpmath import mpf
+from mpmath.libmp import MPZ
+from numeric import Zn, make_zn
+from memory import sizeof
+
+# Entries per segment.  Small enough that inserting or removing at the
+# bottom of a segment (as roll does) is cheap.
+segment_size = 4096
+
+# A run of packable values shorter than this that is broken by a value of
+# another kind is kept as objects, so that mixed stacks don't end up as
+# many tiny segments.
+min_run = 64
+
+# Integers are packed into arrays of C longs:  64 bits on most 64-bit
+# systems, 32 on Windows.
+word = 8*array("l").itemsize
+
+_mpf_new = object.__new__
+
+def _kind(x):
+    '''Return the kind of segment that can pack x:  ("Z", bits, signed)
+    for a Zn, "F" for an mpf whose mantissa fits in a word, or None if
+    it has to be kept as an object.
+    '''
+    t = type(x)
+    if t is Zn:
+        n, bits = x.n, x.num_bits
+        if bits > word:
+            return None
+        if bits == 0 and not -1 << word - 1 <= n < 1 << word - 1:
+            return None
+        return ("Z", bits, x.is_signed)
+    elif t is mpf:
+        sign, man, exp, bc = x._mpf_
+        if bc > word or (not man and exp) or \
+           not -1 << word - 1 <= exp < 1 << word - 1:
+            return None    # Too big, infinite or nan
+        return "F"
+    return None
+
+class _Objects(object):
+    '''A segment of entries kept as they are.'''
+    kind = None
+    def __init__(self, items=()):
+        self.items = list(items)
+    def __len__(self):
+        return len(self.items)
+    def __iter__(self):
+        return iter(self.items)
+    def __getitem__(self, i):
+        return self.items[i]
+    def __setitem__(self, i, x):
+        self.items[i] = x
+    def extend(self, values):
+        self.items.extend(values)
+    def insert(self, i, x):
+        self.items.insert(i, x)
+    def pop(self, i=-1):
+        return self.items.pop(i)
+    def nbytes(self):
+        return sizeof(self.items)
+
+class _Integers(object):
+    '''A segment of Zn values of one width and signedness, kept as an
+    array of C longs.
+    '''
+    def __init__(self, kind):
+        self.kind = kind
+        self.bits, self.signed = bits, signed = kind[1:]
+        if signed:
+            self.values = array("l")
+        else:
+            self.values = array("L")
+    def __len__(self):
+        return len(self.values)
+    def __iter__(self):
+        bits, signed = self.bits, self.signed
+        for n in self.values:
+            yield make_zn(n, bits, signed)
+    def __getitem__(self, i):
+        return make_zn(self.values[i], self.bits, self.signed)
+    def __setitem__(self, i, x):
+        self.values[i] = x.n
+    def extend(self, values):
+        self.values.extend([x.n for x in values])
+    def insert(self, i, x):
+        self.values.insert(i, x.n)
+    def pop(self, i=-1):
+        return make_zn(self.values.pop(i), self.bits, self.signed)
+    def nbytes(self):
+        return sizeof(self.values)
+
+class _Reals(object):
+    '''A segment of mpf values, kept as arrays of their signs, one word
+    mantissas and exponents.  The bit count is the mantissa's length.
+    '''
+    kind = "F"
+    def __init__(self):
+        self.signs = array("B")
+        self.mans = array("L")
+        self.exps = array("l")
+    def __len__(self):
+        return len(self.signs)
+    def _make(self, sign, man, exp):
+        x = _mpf_new(mpf)
+        # The mantissa has to be mpmath's own integer type (an mpz when it
+        # is using gmpy), or the value can't be pickled.
+        x._mpf_ = (sign, MPZ(man), exp, man.bit_length())
+        return x
+    def __iter__(self):
+        make = self._make
+        for i in xrange(len(self.signs)):
+            yield make(self.signs[i], self.mans[i], self.exps[i])
+    def __getitem__(self, i):
+        return self._make(self.signs[i], self.mans[i], self.exps[i])
+    def __setitem__(self, i, x):
+        self.signs[i], self.mans[i], self.exps[i], bc = x._mpf_
+    def extend(self, values):
+        t = [x._mpf_ for x in values]
+        self.signs.extend([v[0] for v in t])
+        self.mans.extend([v[1] for v in t])
+        self.exps.extend([v[2] for v in t])
+    def insert(self, i, x):
+        sign, man, exp, bc = x._mpf_
+        self.signs.insert(i, sign)
+        self.mans.insert(i, man)
+        self.exps.insert(i, exp)
+    def pop(self, i=-1):
+        return self._make(self.signs.pop(i), self.mans.pop(i),
+                          self.exps.pop(i))
+    def nbytes(self):
+        return sizeof(self.signs) + sizeof(self.mans) + sizeof(self.exps)
+
+def _segment(kind):
+    if kind is None:
+        return _Objects()
+    elif kind == "F":
+        return _Reals()
+    return _Integers(kind)
+
+class PackedStore(object):
+    '''A sequence of values, bottom of the stack first, with the same
+    methods as a SpillFile.  It is a list of segments of at most
+    segment_size entries; runs of Zn values of one width and of mpf values
+    are packed into arrays, which take a tenth or less of the memory of
+    the objects.  Values are rebuilt as objects only when they are read.
+    '''
+    def __init__(self):
+        self.segments = []
+        self.count = 0
+        self.starts = None  # Index of the first entry of each segment
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for seg in self.segments:
+            for x in seg:
+                yield x
+
+    def close(self):
+        pass
+
+    def nbytes(self):
+        '''Return the number of bytes used by the segments.'''
+        return sum([seg.nbytes() for seg in self.segments])
+
+    def _locate(self, i):
+        # Return the number of the segment holding entry i and the index
+        # of the entry in it.
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("PackedStore index out of range")
+        # Most accesses are at the bottom (roll) or the top (popn)
+        if i < len(self.segments[0]):
+            return 0, i
+        last = len(self.segments[-1])
+        if i >= self.count - last:
+            return len(self.segments) - 1, i - (self.count - last)
+        if self.starts is None:
+            self.starts, n = [], 0
+            for seg in self.segments:
+                self.starts.append(n)
+                n += len(seg)
+        k = bisect_right(self.starts, i) - 1
+        return k, i - self.starts[k]
+
+    def _holder(self, k, value):
+        # Return segment k, unpacked if it can't hold value
+        seg = self.segments[k]
+        if seg.kind is not None and _kind(value) != seg.kind:
+            seg = self.segments[k] = _Objects(seg)
+        return seg
+
+    def __getitem__(self, i):
+        k, j = self._locate(i)
+        return self.segments[k][j]
+
+    def __setitem__(self, i, value):
+        k, j = self._locate(i)
+        self._holder(k, value)[j] = value
+
+    def extend(self, values):
+        '''Add values to the top.'''
+        run, kind = [], False
+        for x in values:
+            k = _kind(x)
+            if k != kind:
+                if run:
+                    self._append(run, kind)
+                run, kind = [], k
+            run.append(x)
+        if run:
+            self._append(run, kind)
+
+    def _append(self, run, kind):
+        # Add a run of values of one kind to the top
+        segs = self.segments
+        self.count += len(run)
+        self.starts = None
+        while run:
+            if not segs or len(segs[-1]) >= segment_size:
+                segs.append(_segment(kind))
+            elif segs[-1].kind != kind:
+                last = segs[-1]
+                if last.kind is not None and len(last) < min_run:
+                    segs[-1] = _Objects(last)
+                elif last.kind is not None or len(run) >= min_run:
+                    segs.append(_segment(kind))
+            last = segs[-1]
+            n = segment_size - len(last)
+            last.extend(run[:n])
+            run = run[n:]
+
+    def appendleft(self, value):
+        '''Add value at the bottom.'''
+        self.insert(0, value)
+
+    def popleft(self):
+        '''Remove and return the bottom value.'''
+        return self.delete(0)
+
+    def popn(self, n):
+        '''Remove the top n values and return them, top last.'''
+        if n > self.count:
+            raise IndexError("PackedStore index out of range")
+        values = []
+        self.count -= n
+        self.starts = None
+        while n:
+            seg = self.segments[-1]
+            k = min(n, len(seg))
+            values.extend([seg.pop() for i in xrange(k)])
+            if not len(seg):
+                self.segments.pop()
+            n -= k
+        values.reverse()
+        return values
+
+    def insert(self, i, value):
+        if i == self.count:
+            self.extend([value])
+            return
+        k, j = self._locate(i)
+        if j == 0 and len(self.segments[k]) >= segment_size:
+            # Start a new segment rather than grow a full one
+            seg = _segment(_kind(value))
+            self.segments.insert(k, seg)
+        else:
+            seg = self._holder(k, value)
+        seg.insert(j, value)
+        self.count += 1
+        self.starts = None
+
+    def delete(self, i):
+        '''Remove and return the value at index i.'''
+        k, j = self._locate(i)
+        seg = self.segments[k]
+        x = seg.pop(j)
+        if not len(seg):
+            del self.segments[k]
+        self.count -= 1
+        self.starts = None
+        return x
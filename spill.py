@@ -0,0 +1,188 @@
+'''
+A file of pickled stack entries, used to keep the bottom of a very deep
+stack out of memory.
+
+---------------------------------------------------------------------------
+Copyright (c) 2011, Vernon Mauery
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or
+without modification, are permitted provided that the following
+conditions are met:
+
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following
+disclaimer in the documentation and/or other materials provided
+with the distribution.
+* The names of the contributors may not be used to endorse or
+promote products derived from this software without specific
+prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import os
+import mmap
+import struct
+import tempfile
+import copy_reg
+import cPickle as pickle
+from collections import deque
+from mpmath import iv
+
+# Each record is a 4 byte little-endian length followed by the pickle.
+header = struct.Struct("<I")
+
+# Rewrite the file when more than half of it is dead records and it is
+# bigger than this.
+compact_size = 1 << 20
+
+# mpmath's interval type can't be pickled by reference; rebuild it from
+# its endpoint tuples.
+def _make_ivmpf(v):
+    return iv.make_mpf(v)
+
+copy_reg.pickle(iv.mpf, lambda x: (_make_ivmpf, (x._mpi_,)))
+
+class SpillFile(object):
+    '''A sequence of values kept in a temporary file, bottom of the stack
+    first.  Values are appended to the end of the file and read back
+    through a memory map; only a deque of file offsets stays in memory.
+    Removing or replacing an entry leaves a dead record behind, and the
+    file is compacted once the dead records outweigh the live ones.
+    '''
+    def __init__(self, directory):
+        directory = os.path.expanduser(directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.file = tempfile.TemporaryFile(prefix="stack", dir=directory)
+        self.offsets = deque()
+        self.size = 0       # Bytes written
+        self.dead = 0       # Bytes in records no longer referenced
+        self.map = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield self._read(offset)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def _write(self, values):
+        # Append values to the file; returns their offsets
+        offsets, chunks, offset = [], [], self.size
+        for x in values:
+            data = pickle.dumps(x, 2)
+            chunks.append(header.pack(len(data)))
+            chunks.append(data)
+            offsets.append(offset)
+            offset += header.size + len(data)
+        self.file.seek(self.size)
+        self.file.write("".join(chunks))
+        self.size = offset
+        return offsets
+
+    def _record(self, offset):
+        # Return the length of the record at offset, mapping the file again
+        # if it has grown since it was mapped.
+        if self.map is None or offset >= len(self.map):
+            if self.map is not None:
+                self.map.close()
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), self.size,
+                                 access=mmap.ACCESS_READ)
+        return header.size + header.unpack_from(self.map, offset)[0]
+
+    def _read(self, offset):
+        n = self._record(offset)
+        return pickle.loads(self.map[offset + header.size:offset + n])
+
+    def _discard(self, offset):
+        self.dead += self._record(offset)
+
+    def _compact(self):
+        if self.dead < compact_size or 2*self.dead < self.size:
+            return
+        # Copy the live records to a new file without unpickling them
+        f = tempfile.TemporaryFile(prefix="stack", dir=self.directory)
+        offsets, chunks, size = deque(), [], 0
+        for offset in self.offsets:
+            n = self._record(offset)
+            chunks.append(self.map[offset:offset + n])
+            offsets.append(size)
+            size += n
+            if len(chunks) >= 4096:
+                f.write("".join(chunks))
+                chunks = []
+        f.write("".join(chunks))
+        self.close()
+        self.file, self.offsets, self.size, self.dead = f, offsets, size, 0
+
+    def __getitem__(self, i):
+        # i = 0 is the bottom of the stack
+        return self._read(self.offsets[i])
+
+    def __setitem__(self, i, value):
+        self._discard(self.offsets[i])
+        self.offsets[i] = self._write([value])[0]
+        self._compact()
+
+    def extend(self, values):
+        '''Add values to the top.'''
+        self.offsets.extend(self._write(values))
+
+    def appendleft(self, value):
+        '''Add value at the bottom.'''
+        self.offsets.appendleft(self._write([value])[0])
+
+    def popleft(self):
+        '''Remove and return the bottom value.'''
+        offset = self.offsets.popleft()
+        x = self._read(offset)
+        self._discard(offset)
+        self._compact()
+        return x
+
+    def popn(self, n):
+        '''Remove the top n values and return them, top last.'''
+        offsets = [self.offsets.pop() for i in xrange(n)]
+        offsets.reverse()
+        values = [self._read(offset) for offset in offsets]
+        for offset in offsets:
+            self._discard(offset)
+        self._compact()
+        return values
+
+    def insert(self, i, value):
+        offset = self._write([value])[0]
+        self.offsets.rotate(-i)
+        self.offsets.appendleft(offset)
+        self.offsets.rotate(i)
+
+    def delete(self, i):
+        '''Remove and return the value at index i.'''
+        offset = self.offsets[i]
+        x = self._read(offset)
+        del self.offsets[i]
+        self._discard(offset)
+        self._compact()
+        return x
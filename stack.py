@@ -32,6 +32,14 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from mpmath import *
 from debug import *
+from collections import deque
+from itertools import islice, chain
+from spill import SpillFile
+from packed import PackedStore
+
+# Journal entry for push.  A pop right after a push cancels it, so a line
+# like "1 2 +" only records one entry.
+_push = ("push",)
 
 class Stack(object):
     '''This object provides a stack and is intended to be used as an RPN
@@ -56,72 +64,340 @@ class Stack(object):
     numerical functions on them.
     '''
     def __init__(self):
-        '''The stack is implemented as a list; the top of the stack is the
-        last element.
+        '''The stack is implemented as a deque; the top of the stack is the
+        last element.  A deque lets roll and rolld move an item between the
+        top and the bottom in O(1) time and is just as fast as a list for
+        indexing near the top.
+
+        When journal is a list, every change to the stack appends a small
+        record of how to reverse it, so undo() costs O(changed entries)
+        rather than a copy of the whole stack.
+
+        After set_spill(depth), once more than 2*depth entries are in the
+        deque all but the top depth are moved to a SpillFile, or to a
+        PackedStore in memory if no directory was given.  They are read
+        back a chunk at a time as the stack shrinks, or one at a time when
+        they are picked, rolled or set.
+        '''
+        self.stack = deque()
+        self.spill = None       # SpillFile or PackedStore holding the bottom
+        self.spill_depth = 0
+        self.spill_dir = None
+        self.journal = None
+        self.lastx = None
+
+    def set_spill(self, depth, directory=None):
+        '''Keep at most 2*depth entries in the deque and the rest in a file
+        in directory, or packed in memory if directory is None.  A depth of
+        0 reads spilled entries back into the deque.
         '''
-        self.stack = []
+        if self.spill is not None and (not depth or directory != self.spill_dir):
+            # Undo may still refer to the old spill file; leave it alone.
+            self.stack = deque(chain(self.spill, self.stack))
+            self.spill = None
+        self.spill_depth, self.spill_dir = depth, directory
+        if depth:
+            self._spill()
+
+    def _spill(self):
+        depth = self.spill_depth
+        if len(self.stack) > 2*depth:
+            if self.spill is None:
+                if self.spill_dir is None:
+                    self.spill = PackedStore()
+                else:
+                    self.spill = SpillFile(self.spill_dir)
+            n = len(self.stack) - depth
+            self.spill.extend([self.stack.popleft() for i in xrange(n)])
+
+    def _fault(self, n=1):
+        # Read entries back from the spill file until n are in memory
+        while len(self.stack) < n and self.spill:
+            k = min(max(self.spill_depth, n - len(self.stack)), len(self.spill))
+            self.stack.extendleft(reversed(self.spill.popn(k)))
 
     def swap(self):
+        if len(self.stack) < 2:
+            self._fault(2)
         if len(self.stack) < 2:
             raise IndexError("%s" % fln())
         self.stack[-1], self.stack[-2] = self.stack[-2], self.stack[-1]
+        if self.journal is not None:
+            self.journal.append(("swap",))
 
     def __len__(self):
-        return len(self.stack)
+        if self.spill is None:
+            return len(self.stack)
+        return len(self.spill) + len(self.stack)
+
+    def __iter__(self):
+        '''Iterate from the bottom of the stack to the top.'''
+        if self.spill is not None:
+            for x in self.spill:
+                yield x
+        for x in self.stack:
+            yield x
 
     def push(self, x):
         self.stack.append(x)
+        if self.journal is not None:
+            self.journal.append(_push)
+        if self.spill_depth and len(self.stack) > 2*self.spill_depth:
+            self._spill()
 
     def pop(self):
+        if not self.stack and self.spill:
+            self._fault()
         if self.stack:
-            return self.stack.pop(-1)
+            x = self.stack.pop()
+            if self.journal is not None:
+                if self.journal and self.journal[-1] is _push:
+                    self.journal.pop()
+                else:
+                    self.journal.append(("pop", x))
+            return x
         else:
             raise IndexError("%s" % fln() + "Stack is empty (tried to pop)")
 
     def roll(self, end):
-        if self.stack:
-            if len(self.stack) == 1:
+        n = len(self)
+        if n:
+            if n == 1:
                 return
             if end == 0:
-                head = self.stack.pop(end)
-                self.stack += [head]
+                self._rotate(-1)    # Bottom item to the top
+            elif end == -1:
+                self._rotate(1)     # Top item to the bottom
+            elif end < 0:
+                self._roll(end + n)
             else:
-                tail = self.stack.pop(end)
-                self.stack = [tail] + self.stack
+                self._roll(end)
         else:
             raise IndexError("%s" % fln() + "Stack is empty (tried to roll)")
 
+    def _rotate(self, n):
+        if not self.spill:
+            self.stack.rotate(n)
+        elif n == 1:
+            self._fault()
+            self.spill.appendleft(self.stack.pop())
+            self._fault()
+        else:
+            self.stack.append(self.spill.popleft())
+            if self.spill_depth:
+                self._spill()
+        if self.journal is not None:
+            self.journal.append(("rotate", n))
+
+    def _delete(self, i):
+        # Remove and return the entry i places from the bottom
+        if self.spill:
+            if i < len(self.spill):
+                return self.spill.delete(i)
+            i -= len(self.spill)
+        x = self.stack[i]
+        del self.stack[i]
+        if not self.stack:
+            self._fault()
+        return x
+
+    def _insert(self, i, x):
+        # Insert x so that it is i places from the bottom
+        if self.spill:
+            if i < len(self.spill):
+                self.spill.insert(i, x)
+                return
+            i -= len(self.spill)
+        self.stack.rotate(-i)
+        self.stack.appendleft(x)
+        self.stack.rotate(i)
+
+    def _roll(self, end):
+        if end < 0:
+            raise IndexError("%s" % fln() + "Stack size is %d" % len(self))
+        if self.spill:
+            self._insert(0, self._delete(end))
+        else:
+            item = self.stack[end]
+            del self.stack[end]
+            self.stack.appendleft(item)
+        if self.journal is not None:
+            self.journal.append(("roll", end))
+
+    def _unroll(self, end):
+        # The inverse of _roll(end): put the bottom item back at index end.
+        if self.spill:
+            self._insert(end, self._delete(0))
+        else:
+            item = self.stack.popleft()
+            self.stack.rotate(-end)
+            self.stack.appendleft(item)
+            self.stack.rotate(end)
+        if self.journal is not None:
+            self.journal.append(("unroll", end))
+
+    def extend(self, items):
+        '''Push each of items in turn; the last one ends up on top.'''
+        n = len(self.stack)
+        self.stack.extend(items)
+        if self.journal is not None:
+            self.journal.append(("extend", len(self.stack) - n))
+        if self.spill_depth:
+            self._spill()
+
+    def popn(self, n):
+        '''Pop the top n items and return them in stack order (the old top
+        last), so that extend() puts them back.
+        '''
+        if n > len(self):
+            raise IndexError("%s" % fln() + "Stack size is %d" % len(self))
+        if n > len(self.stack):
+            self._fault(n)
+        items = [self.stack.pop() for i in xrange(n)]
+        items.reverse()
+        if not self.stack:
+            self._fault()
+        if self.journal is not None:
+            self.journal.append(("popn", items))
+        return items
+
     def clear_stack(self):
-        self.stack = []
+        self._replace(deque())
+
+    def snapshot(self):
+        '''Return a copy of the stack's contents for restore().'''
+        return list(self)
+
+    def restore(self, snapshot):
+        '''Replace the stack's contents with a snapshot().'''
+        self._replace(deque(snapshot))
+
+    def _replace(self, stack, spill=None):
+        # The old deque and spill file are kept whole rather than copied,
+        # so clearing even a very deep stack is cheap to undo.
+        if self.journal is not None:
+            self.journal.append(("replace", self.stack, self.spill))
+        self.stack, self.spill = stack, spill
+        if self.spill_depth:
+            self._spill()
+
+    def undo(self, journal):
+        '''Reverse the changes recorded in journal, most recent first.
+        Returns the journal of the reversal, which undo() will use to
+        redo the changes.  The current journal is left untouched.
+        '''
+        saved, self.journal = self.journal, []
+        try:
+            for entry in reversed(journal):
+                op = entry[0]
+                if op == "push":
+                    self.pop()
+                elif op == "pop":
+                    self.push(entry[1])
+                elif op == "swap":
+                    self.swap()
+                elif op == "rotate":
+                    self._rotate(-entry[1])
+                elif op == "roll":
+                    self._unroll(entry[1])
+                elif op == "unroll":
+                    self._roll(entry[1])
+                elif op == "extend":
+                    self.popn(entry[1])
+                elif op == "popn":
+                    self.extend(entry[1])
+                elif op == "replace":
+                    self._replace(entry[1], entry[2])
+                elif op == "set":
+                    self[entry[1]] = entry[2]
+            return self.journal
+        finally:
+            self.journal = saved
+
+    def journal_values(self, journal):
+        '''Yield the stack entries a journal holds on to in memory.'''
+        for entry in journal:
+            op = entry[0]
+            if op == "pop":
+                yield entry[1]
+            elif op in ("popn", "replace"):
+                for x in entry[1]:
+                    yield x
+            elif op == "set":
+                yield entry[2]
 
     def __setitem__(self, i, value):
         # i = 0 is top of stack
-        if len(self.stack) == 0:
+        n = len(self)
+        if n == 0:
             raise IndexError("%s" % fln() + "Stack is empty (tried to set item %d)" % i)
-        if i < 0 or i >= len(self.stack) - 1:
-            raise IndexError("%s" % fln() + "Stack size is %d" % len(self.stack))
-        self.stack[len(self.stack) - 1 - i] = value
+        if i < 0 or i >= n - 1:
+            raise IndexError("%s" % fln() + "Stack size is %d" % n)
+        if self.journal is not None:
+            self.journal.append(("set", i, self[i]))
+        if i < len(self.stack):
+            self.stack[-1 - i] = value
+        else:
+            self.spill[n - 1 - i] = value
 
     def __getitem__(self, i):
         # i = 0 is top of stack
-        n = len(self.stack)
+        n = len(self)
         if n == 0:
             raise IndexError("%s" % fln() + "Stack is empty (tried to get item %d)" % i)
         if i < 0 or i >= n:
             raise IndexError("%s" % fln() + "Stack size is smaller than %d" % (n+1))
-        return self.stack[n - 1 - i]
+        if i < len(self.stack):
+            return self.stack[-1 - i]
+        return self.spill[n - 1 - i]
+
+    def window(self, size=0):
+        '''Return a list of the top size items (all of them if size is 0)
+        with the top of the stack last.  Only the returned items are
+        touched, so this is cheap no matter how deep the stack is.
+        '''
+        if size and size <= len(self.stack):
+            s = list(islice(reversed(self.stack), size))
+            s.reverse()
+            return s
+        if not self.spill:
+            return list(self.stack)
+        n = len(self)
+        if not size or size > n:
+            size = n
+        s = [self.spill[i] for i in xrange(n - size, len(self.spill))]
+        s.extend(self.stack)
+        return s
+
+    def iterwindow(self, size=0):
+        '''Iterate over the top size items (all of them if size is 0),
+        the top of the stack last.  It takes time in proportion to size,
+        however deep the stack is.
+        '''
+        n = len(self)
+        if not size or size > n:
+            size = n
+        h = len(self.stack)
+        if size > h:
+            for i in xrange(n - size, len(self.spill)):
+                yield self.spill[i]
+        if size >= h:
+            for x in self.stack:
+                yield x
+            return
+        # islice from the bottom would walk the whole deque
+        s = list(islice(reversed(self.stack), size))
+        s.reverse()
+        for x in s:
+            yield x
 
     def _string(self, func, size=0):
         '''Used to pretty print the stack.  func should be a function that
         will format a number.  If size is nonzero, only display that many
-        items.  Note:  we make a copy of the stack so we can't possibly
-        mess it up.
+        items.  Only the displayed items are copied and formatted.
         '''
-        s = self.stack[:]
+        s = self.window(size)
         if not size or size > len(s): size = max(1, len(s))
-        s.reverse()
-        s = s[:size]
-        s.reverse()
         if debug():
             fmt = "%%(vtype)s | %%(index) %dd: %%(value)s" % (2+int(log10(max(len(s),1))))
         else:
@@ -147,12 +423,12 @@ class Stack(object):
 
     def __str__(self):
         s = ""
-        if self.stack: s = self._string(str)
+        if len(self): s = self._string(str)
         return s
 
     def __repr__(self):
         s = ""
-        if self.stack: s = self._string(repr)
+        if len(self): s = self._string(repr)
         return s
 
 if __name__ == "__main__":
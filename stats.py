@@ -0,0 +1,294 @@
+'''
+Statistics over the numbers on the stack, computed in one pass without
+sorting.
+
+---------------------------------------------------------------------------
+Copyright (c) 2011, Vernon Mauery
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or
+without modification, are permitted provided that the following
+conditions are met:
+
+* Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+* Redistributions in binary form must reproduce the above
+copyright notice, this list of conditions and the following
+disclaimer in the documentation and/or other materials provided
+with the distribution.
+* The names of the contributors may not be used to endorse or
+promote products derived from this software without specific
+prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+'''
+
+import random
+from bisect import bisect_right
+from fractions import Fraction
+import mpmath
+from mpmath import mpf
+from numeric import isint, Rational, Fixed, Julian, Convert, MPF, sort_key, \
+    key_value
+from debug import *
+
+def exact(x):
+    '''Return x as an int or Fraction, or None if it is not exact.'''
+    if isint(x):
+        return int(x)
+    elif isinstance(x, Rational):
+        return Fraction(x.n, x.d)
+    elif isinstance(x, Fixed):
+        return Fraction(x.raw, 1 << x.format.frac_bits)
+    return None
+
+def to_mpf(v):
+    '''Convert an int, Fraction or stack number to mpf.'''
+    if isinstance(v, Fraction):
+        return mpf(v.numerator)/v.denominator
+    return Convert(v, MPF)
+
+def real(x, v=None):
+    '''Convert a real stack number to mpf; v is its exact value, if
+    known.'''
+    if v is not None:
+        return to_mpf(v)
+    if isinstance(x, Julian):
+        x = x.to_mpf()
+    if not isinstance(x, mpf):
+        raise ValueError("%sStatistics need real numbers, not %s" %
+                         (fln(), type(x).__name__))
+    return x
+
+def divide(a, b):
+    '''a/b, exactly if both are ints or Fractions.'''
+    if isinstance(a, mpf) or isinstance(b, mpf):
+        return a/b
+    return Fraction(a, b)
+
+def root(v):
+    '''The square root of an exact or mpf value, as mpf.'''
+    return mpmath.sqrt(to_mpf(v))
+
+class Moments(object):
+    '''The count, mean and sum of squared deviations (M2) of numbers given
+    to add() one at a time.  Integers and rationals are summed exactly, so
+    their mean and variance are exact.  Other reals are combined with
+    Welford's update, which does not lose precision to cancellation the
+    way the sum of squares does, and the two groups are merged at the end.
+    '''
+    def __init__(self):
+        self.n = 0
+        self.exact_n = 0    # Exact values:  count, sum and sum of squares
+        self.sum = 0
+        self.squares = 0
+        self.real_n = 0     # Other reals:  count, mean and M2
+        self.real_mean = mpf(0)
+        self.real_m2 = mpf(0)
+
+    def add(self, x):
+        v = exact(x)
+        if v is not None:
+            self.exact_n += 1
+            self.sum += v
+            self.squares += v*v
+        else:
+            x = real(x)
+            self.real_n += 1
+            delta = x - self.real_mean
+            self.real_mean += delta/self.real_n
+            self.real_m2 += delta*(x - self.real_mean)
+        self.n += 1
+
+    def mean(self):
+        '''Returns an int or Fraction if all the numbers were exact.'''
+        if not self.n:
+            raise ValueError("%sNo numbers" % fln())
+        if not self.real_n:
+            return Fraction(self.sum, self.exact_n)
+        if not self.exact_n:
+            return self.real_mean
+        return (to_mpf(self.sum) + self.real_mean*self.real_n)/self.n
+
+    def m2(self):
+        exact_m2 = 0
+        if self.exact_n:
+            exact_m2 = self.squares - Fraction(self.sum**2, self.exact_n)
+        if not self.real_n:
+            return exact_m2
+        if not self.exact_n:
+            return self.real_m2
+        delta = self.real_mean - to_mpf(Fraction(self.sum, self.exact_n))
+        return to_mpf(exact_m2) + self.real_m2 + \
+            delta*delta*self.exact_n*self.real_n/self.n
+
+    def variance(self):
+        '''The sample variance (divided by n - 1).'''
+        if self.n < 2:
+            raise ValueError("%sVariance needs at least 2 numbers" % fln())
+        m2 = self.m2()
+        if isinstance(m2, mpf):
+            return m2/(self.n - 1)
+        return Fraction(m2, self.n - 1)
+
+def select(keyed, k):
+    '''Return the k'th smallest (counting from 0) of a list of distinct
+    items without sorting it.  This is quickselect:  each pass partitions
+    around a random pivot and keeps only the side holding the answer, so
+    it takes O(n) comparisons on average.
+    '''
+    while True:
+        pivot = random.choice(keyed)
+        lows = [x for x in keyed if x < pivot]
+        if k < len(lows):
+            keyed = lows
+            continue
+        highs = [x for x in keyed if x > pivot]
+        if k < len(keyed) - len(highs):
+            return pivot
+        k -= len(keyed) - len(highs)
+        keyed = highs
+
+def quantile(values, p):
+    '''Return the p quantile (0 <= p <= 1) of a sequence of reals, using
+    linear interpolation between the nearest two (the usual definition in
+    spreadsheets and numpy).  If p and the two numbers are exact, so is
+    the result (an int or Fraction); if it lands on one of the numbers,
+    that number is returned.
+    '''
+    # The index makes the keys distinct and keeps numbers of different
+    # types from ever being compared directly.
+    keyed = [(sort_key(x), i) for i, x in enumerate(values)]
+    n = len(keyed)
+    if not n:
+        raise ValueError("%sNo numbers" % fln())
+    if p < 0 or p > 1:
+        raise ValueError("%sThe quantile must be between 0 and 1" % fln())
+    v = exact(p)
+    if v is not None:
+        h = v*(n - 1)
+    else:
+        h = to_mpf(p)*(n - 1)
+    lo = int(h)
+    low = select(keyed, lo)
+    a = values[low[1]]
+    if h == lo:
+        return a
+    b = values[min([x for x in keyed if x > low])[1]]
+    if v is not None and exact(a) is not None and exact(b) is not None:
+        return exact(a) + (h - lo)*(exact(b) - exact(a))
+    a = to_mpf(a)
+    return a + to_mpf(h - lo)*(to_mpf(b) - a)
+
+def bin_edges(keys, nbins):
+    '''Return nbins + 1 equally spaced edges (ints or Fractions) from the
+    smallest to the largest of a list of sort_keys.
+    '''
+    if not keys:
+        raise ValueError("%sNo numbers" % fln())
+    lo, hi = key_value(min(keys)), key_value(max(keys))
+    if lo == hi:
+        hi = lo + 1
+    width = Fraction(hi - lo, nbins)
+    return [lo + i*width for i in xrange(nbins)] + [hi]
+
+def histogram(keys, edges):
+    '''Count the sort_keys in keys that fall between each pair of the
+    increasing edges, with one bisection per key.  A bin holds its lower
+    edge; the last one holds its upper edge too.  Returns the list of
+    counts and the numbers of keys below and above the edges.
+    '''
+    bounds = [sort_key(e) for e in edges]
+    last = len(bounds)
+    top = bounds[-1]
+    counts = [0]*(last + 1)     # counts[0] is below the first edge
+    for k in keys:
+        i = bisect_right(bounds, k)
+        if i == last and k == top:
+            i -= 1
+        counts[i] += 1
+    return counts[1:-1], counts[0], counts[-1]
+
+class Sums(object):
+    '''The running sums of the summation registers:  n, sum x, sum y,
+    sum x**2, sum y**2 and sum x*y of the (x, y) points added and removed
+    one at a time, so they take constant memory however many points there
+    are.  Points with integer or rational coordinates are summed exactly;
+    the others are summed as mpf.
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.n = 0
+        self.real_n = 0     # Points that were summed as mpf
+        self.exact = [0]*5
+        self.real = [mpf(0)]*5
+
+    def add(self, x, y, sign=1):
+        '''Add the point (x, y), or remove it if sign is -1.'''
+        if sign < 0 and not self.n:
+            raise ValueError("%sThe summation registers are empty" % fln())
+        a, b = exact(x), exact(y)
+        if a is not None and b is not None:
+            sums = self.exact
+        else:
+            a, b = real(x, a), real(y, b)
+            sums = self.real
+            self.real_n += sign
+        for i, v in enumerate((a, b, a*a, b*b, a*b)):
+            sums[i] += sign*v
+        self.n += sign
+        if not self.real_n:
+            # What is left is exact; drop the rounding errors
+            self.real = [mpf(0)]*5
+
+    def sums(self):
+        '''Return n and the five sums, which are ints or Fractions if all
+        the points were exact and mpf otherwise.
+        '''
+        if not self.n:
+            raise ValueError("%sThe summation registers are empty" % fln())
+        if not self.real_n:
+            return [self.n] + self.exact
+        return [self.n] + [to_mpf(v) + r for v, r in zip(self.exact, self.real)]
+
+    def mean(self):
+        '''Return the means of x and y.'''
+        n, sx, sy, sxx, syy, sxy = self.sums()
+        return divide(sx, n), divide(sy, n)
+
+    def sdev(self):
+        '''Return the sample standard deviations of x and y.'''
+        n, sx, sy, sxx, syy, sxy = self.sums()
+        if n < 2:
+            raise ValueError("%sNeed at least 2 points" % fln())
+        d = n*(n - 1)
+        return root(divide(n*sxx - sx*sx, d)), root(divide(n*syy - sy*sy, d))
+
+    def line(self):
+        '''Return the slope and y intercept of the least squares line.'''
+        n, sx, sy, sxx, syy, sxy = self.sums()
+        d = n*sxx - sx*sx
+        if not d:
+            raise ValueError("%sThe x values are all the same" % fln())
+        slope = divide(n*sxy - sx*sy, d)
+        return slope, divide(sy - slope*sx, n)
+
+    def corr(self):
+        '''Return the correlation coefficient of x and y.'''
+        n, sx, sy, sxx, syy, sxy = self.sums()
+        d = (n*sxx - sx*sx)*(n*syy - sy*sy)
+        if not d:
+            raise ValueError("%sThe x or y values are all the same" % fln())
+        return divide(n*sxy - sx*sy, root(d))